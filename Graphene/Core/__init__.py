@@ -1,11 +1,38 @@
+from .arena import BufferArena, scratch
+from .cache import ByteLRU, CacheStats, image_cache, node_cache
+from .disk_cache import DiskCache, disk_cache
+from .graph import Graph
 from .image_processing import (
+    MERGE_MODES,
+    ChannelView,
+    apply_lut,
+    brightness_lut,
     colour_balance,
+    compose_luts,
+    contrast_lut,
     get_histogram,
+    get_lut_histogram,
+    get_mean,
+    get_mean_luma,
     get_rgb_histogram,
+    identity_lut,
     levels,
+    levels_lut,
     merge,
     split_rgb,
     split_smh,
+    to_texture,
+)
+from .images import FULL_FRAME, ChannelImage, Image, ImageManager, Region
+from .luts import LUT_SIZES, apply_3d_lut, bake, read_cube, write_cube
+from .prefetch import Prefetcher
+from .tiling import map_tiles
+from .utils import (
+    Cancelled,
+    LatestWins,
+    WorkerPool,
+    get_pool,
+    natural_time,
+    run_graph,
+    shutdown_pools,
 )
-from .images import Image, ImageManager
-from .utils import natural_time
@@ -0,0 +1,83 @@
+"""
+Scratch arrays for kernels. A slider drag runs the same kernels on the same proxy over and over, so the temporaries they
+need are the same shapes every time. Handing them back here instead of to the allocator means the next call gets memory
+that is already paged in, instead of a fresh block it has to fault in (and the allocator has to find).
+"""
+
+import contextlib
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+logger = logging.getLogger("Core.Arena")
+
+
+class BufferArena:
+    """
+    Idle arrays by (shape, dtype). borrow() hands one out (or makes one) and takes it back at the end of the with block,
+    so a borrowed array holds whatever the last user left in it and must not be kept or returned. Thread safe, every
+    borrower gets its own array. Idle arrays that don't fit in `budget` bytes are let go, least recently used first.
+    """
+
+    def __init__(self, budget: int, name="Arena"):
+        self.budget = budget
+        self.name = name
+        self.size = 0
+        self.allocations = 0
+        self.reuses = 0
+        self._free: OrderedDict[tuple, list[np.ndarray]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def borrow(self, shape, dtype=np.float32):
+        key = (tuple(shape), np.dtype(dtype).str)
+        buffer = None
+        with self._lock:
+            free = self._free.get(key)
+            if free:
+                buffer = free.pop()
+                self.size -= buffer.nbytes
+                self.reuses += 1
+            else:
+                self.allocations += 1
+        if buffer is None:
+            buffer = np.empty(shape, dtype=dtype)
+        try:
+            yield buffer
+        finally:
+            self._give_back(key, buffer)
+
+    def _give_back(self, key, buffer: np.ndarray):
+        with self._lock:
+            if buffer.nbytes > self.budget:
+                return
+            self._free.setdefault(key, []).append(buffer)
+            self._free.move_to_end(key)
+            self.size += buffer.nbytes
+            while self.size > self.budget:
+                oldest, free = next(iter(self._free.items()))
+                self.size -= free.pop(0).nbytes
+                if not free:
+                    del self._free[oldest]
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
+            self.size = 0
+
+    def report(self) -> str:
+        with self._lock:
+            idle = sum(len(free) for free in self._free.values())
+            return (
+                f"{self.name}: {idle} idle buffers, {self.size / (1 << 20):.1f} of "
+                f"{self.budget / (1 << 20):.0f} MiB, {self.allocations} allocations, {self.reuses} reuses"
+            )
+
+
+# Set GRAPHENE_SCRATCH_MB to change how much idle scratch memory is kept around
+scratch = BufferArena(
+    int(os.environ.get("GRAPHENE_SCRATCH_MB", 256)) << 20, name="Scratch Buffers"
+)
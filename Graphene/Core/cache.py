@@ -0,0 +1,162 @@
+"""
+A least recently used cache that is bounded by how many bytes it holds instead of how many things, for decoded images
+and everything that gets worked out from them. Keeping 40 full resolution images around is a few gigabytes, keeping
+40 thumbnails is nothing, a count can't tell the difference.
+"""
+
+import logging
+import os
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Hashable
+
+import numpy as np
+import PIL.Image as PImage
+
+logger = logging.getLogger("Core.Cache")
+
+CATEGORIES = ("full", "proxy", "thumbnail", "texture", "derived", "node")
+
+# bytes per pixel per band, for the modes that aren't 8 bit
+_MODE_DEPTH = {"I": 4, "F": 4, "I;16": 2, "I;16B": 2, "I;16L": 2, "1": 1}
+
+
+def sizeof(value) -> int:
+    """Roughly how many bytes of pixels something holds"""
+    if isinstance(value, PImage.Image):
+        width, height = value.size
+        return width * height * len(value.getbands()) * _MODE_DEPTH.get(value.mode, 1)
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if isinstance(value, list):
+        return 8 * len(value)
+    return getattr(value, "nbytes", 0)
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+    evictions: int = 0
+    entries: int = 0
+    bytes: int = 0
+
+    def __str__(self):
+        return (
+            f"{self.entries} entries, {self.bytes / (1 << 20):.1f} MiB, "
+            f"{self.hits} hits, {self.misses} misses, {self.evictions} evictions"
+        )
+
+
+class ByteLRU:
+    """
+    Thread safe LRU cache that evicts the least recently used entries once the total size of what it holds goes over
+    `budget` bytes. Every entry belongs to a category (see CATEGORIES) that gets its own counters.
+    """
+
+    def __init__(self, budget: int, name="Cache"):
+        self.budget = budget
+        self.name = name
+        self.size = 0
+        self._entries: OrderedDict[Hashable, tuple[object, int, str]] = OrderedDict()
+        self._stats = {category: CacheStats() for category in CATEGORIES}
+        self._lock = threading.RLock()
+
+    def get(self, key: Hashable, category: str, default=None):
+        with self._lock:
+            stats = self._stats[category]
+            if key not in self._entries:
+                stats.misses += 1
+                return default
+            stats.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def peek(self, key: Hashable, default=None):
+        """Like get, but doesn't count as a use"""
+        with self._lock:
+            entry = self._entries.get(key)
+            return default if entry is None else entry[0]
+
+    def put(self, key: Hashable, value, category: str, nbytes: int | None = None):
+        nbytes = sizeof(value) if nbytes is None else nbytes
+        with self._lock:
+            self.discard(key)
+            if nbytes > self.budget:
+                logger.debug(f"{self.name}: {key} is bigger than the whole budget")
+                return value
+            self._entries[key] = (value, nbytes, category)
+            self.size += nbytes
+            stats = self._stats[category]
+            stats.entries += 1
+            stats.bytes += nbytes
+            self._evict()
+        return value
+
+    def get_or_create(self, key: Hashable, category: str, factory: Callable):
+        """
+        Returns the cached value, or makes it with factory() and caches that. The factory runs without the lock held,
+        so two threads asking for the same missing key might both make it, the last one wins.
+        """
+        sentinel = object()
+        value = self.get(key, category, sentinel)
+        if value is sentinel:
+            value = self.put(key, factory(), category)
+        return value
+
+    def discard(self, key: Hashable):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None:
+                return
+            _, nbytes, category = entry
+            self.size -= nbytes
+            stats = self._stats[category]
+            stats.entries -= 1
+            stats.bytes -= nbytes
+
+    def set_budget(self, budget: int):
+        with self._lock:
+            self.budget = budget
+            self._evict()
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self.discard(key)
+
+    def _evict(self):
+        while self.size > self.budget and self._entries:
+            key, (_, nbytes, category) = next(iter(self._entries.items()))
+            self.discard(key)
+            self._stats[category].evictions += 1
+            logger.debug(f"{self.name}: evicted {key} ({nbytes} bytes)")
+
+    def stats(self) -> dict[str, CacheStats]:
+        with self._lock:
+            return {
+                category: CacheStats(**vars(stats))
+                for category, stats in self._stats.items()
+            }
+
+    def report(self) -> str:
+        lines = [
+            f"{self.name}: {self.size / (1 << 20):.1f} of {self.budget / (1 << 20):.0f} MiB"
+        ]
+        for category, stats in self.stats().items():
+            if not (stats.hits or stats.misses or stats.entries):
+                continue
+            lines.append(f"  {category:<9} {stats}")
+        return "\n".join(lines)
+
+
+# Set GRAPHENE_CACHE_MB to change how much memory decoded images can take up
+image_cache = ByteLRU(
+    int(os.environ.get("GRAPHENE_CACHE_MB", 2048)) << 20, name="Image Cache"
+)
+
+# Outputs of nodes, keyed by what they were worked out from (see Node.get_params). GRAPHENE_NODE_CACHE_MB sets its size
+node_cache = ByteLRU(
+    int(os.environ.get("GRAPHENE_NODE_CACHE_MB", 512)) << 20, name="Node Cache"
+)
@@ -0,0 +1,104 @@
+"""
+Thumbnails and small pyramid levels saved as .npy files, so that opening a roll again doesn't decode every image just
+to show thumbnails. Files are named after the image's cache key (path, modified time and size), so editing an image
+gives it new entries, and the old ones are deleted once they are the least recently used and the cache is full.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Callable, Hashable
+
+import numpy as np
+
+logger = logging.getLogger("Core.DiskCache")
+
+
+class DiskCache:
+    """
+    Arrays on disk, loaded memory mapped. Reading an entry touches its file, so the modified times double as the LRU
+    order when collect() has to make room.
+    """
+
+    def __init__(self, root: Path, budget: int):
+        self.root = Path(root)
+        self.budget = budget
+        self.size = None
+        self._lock = threading.Lock()
+
+    def get_path(self, key: Hashable) -> Path:
+        digest = hashlib.sha1(repr(key).encode()).hexdigest()
+        return self.root / digest[:2] / f"{digest}.npy"
+
+    def load(self, key: Hashable) -> np.ndarray | None:
+        path = self.get_path(key)
+        try:
+            array = np.load(path, mmap_mode="r")
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return array
+
+    def save(self, key: Hashable, array: np.ndarray):
+        path = self.get_path(key)
+        temporary = path.with_suffix(f".{threading.get_ident()}.tmp")
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            with open(temporary, "wb") as file:
+                np.save(file, np.ascontiguousarray(array))
+            os.replace(temporary, path)
+        except OSError as e:
+            logger.warning(f"Could not write {path}: {e}")
+            temporary.unlink(missing_ok=True)
+            return
+
+        with self._lock:
+            if self.size is not None:
+                self.size += path.stat().st_size
+        if self.size is None or self.size > self.budget:
+            self.collect()
+
+    def get_or_create(self, key: Hashable, factory: Callable[[], np.ndarray]):
+        array = self.load(key)
+        if array is None:
+            array = factory()
+            self.save(key, array)
+        return array
+
+    def collect(self, target=0.9):
+        """Deletes the least recently used files until the cache is under target * budget"""
+        with self._lock:
+            files = []
+            for path in self.root.glob("*/*.npy"):
+                try:
+                    stat = path.stat()
+                except OSError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+            self.size = sum(size for _, size, _ in files)
+            if self.size <= self.budget:
+                return
+
+            removed = 0
+            for _, size, path in sorted(files):
+                if self.size <= self.budget * target:
+                    break
+                path.unlink(missing_ok=True)
+                self.size -= size
+                removed += 1
+            logger.debug(f"Removed {removed} files from {self.root}")
+
+    def clear(self):
+        with self._lock:
+            for path in self.root.glob("*/*.npy"):
+                path.unlink(missing_ok=True)
+            self.size = 0
+
+
+# Set GRAPHENE_DISK_CACHE and GRAPHENE_DISK_CACHE_MB to move it or change how big it can get
+disk_cache = DiskCache(
+    Path(os.environ.get("GRAPHENE_DISK_CACHE", "./Data/cache")),
+    int(os.environ.get("GRAPHENE_DISK_CACHE_MB", 1024)) << 20,
+)
@@ -0,0 +1,206 @@
+"""
+The shape of a node graph, kept up to date one edit at a time instead of being worked out again for every evaluation:
+who feeds whom (both ways), the edges by id and attribute, a topological order and which nodes end up at a sink.
+It doesn't care what nodes and edges are, edges just need .id, .input, .output, .input_attribute_id and
+.output_attribute_id (like Nodes.Edge).
+"""
+
+import logging
+from collections import Counter
+from typing import Callable, Hashable
+
+logger = logging.getLogger("Core.Graph")
+
+
+class Graph:
+    """
+    Adding an edge is O(1) if it already goes along the topological order, otherwise only the nodes between its ends
+    are moved (Pearce and Kelly's dynamic topological sort), which is also where cycles are found. Removing edges keeps
+    the order as it is.
+
+    `visible` is the set of nodes that have a path to a sink (a node is_sink says yes to), only nodes whose visibility
+    can actually change get looked at when an edge comes or goes.
+
+    Args:
+        is_sink: Whether a node is where the graph is looked at (InspectNodes in the editor)
+    """
+
+    def __init__(self, is_sink: Callable[[Hashable], bool] = lambda node: False):
+        self.is_sink = is_sink
+        self.successors: dict[Hashable, set] = {}
+        self.predecessors: dict[Hashable, set] = {}
+        self.edges: dict[Hashable, object] = {}
+        self.edges_by_attribute: dict[Hashable, set] = {}
+        self.visible: set = set()
+        # how many edges go from one node to another, nodes can be linked more than once (like a splitter into Merge)
+        self._links: Counter = Counter()
+        self._out_degree: Counter = Counter()
+        self._position: dict[Hashable, int] = {}
+        self._next_position = 0
+        self._order: list | None = None
+
+    def __contains__(self, node):
+        return node in self._position
+
+    def __iter__(self):
+        return iter(self._position)
+
+    def __len__(self):
+        return len(self._position)
+
+    @property
+    def order(self) -> list:
+        """Every node, each one after everything that feeds it. Don't change it"""
+        if self._order is None:
+            self._order = sorted(self._position, key=self._position.__getitem__)
+        return self._order
+
+    def out_degree(self, node) -> int:
+        """How many edges leave node, which can be more than len(successors[node])"""
+        return self._out_degree[node]
+
+    def add_node(self, node):
+        if node in self._position:
+            return
+        self._position[node] = self._next_position
+        self._next_position += 1
+        self.successors[node] = set()
+        self.predecessors[node] = set()
+        if self.is_sink(node):
+            self.visible.add(node)
+        self._order = None
+
+    def remove_node(self, node):
+        """Removes node and whatever edges it still has"""
+        if node not in self._position:
+            return
+        for edge_id in [
+            edge_id
+            for edge_id, edge in self.edges.items()
+            if edge.input is node or edge.output is node
+        ]:
+            self.remove_edge(edge_id)
+        del self._position[node]
+        del self.successors[node]
+        del self.predecessors[node]
+        del self._out_degree[node]
+        self.visible.discard(node)
+        self._order = None
+
+    def reaches(self, start, end) -> bool:
+        """Whether there is a path from start to end, only nodes between the two in the order are looked at"""
+        if start is end:
+            return True
+        limit = self._position[end]
+        if self._position[start] > limit:
+            return False
+        stack = [start]
+        seen = {start}
+        while stack:
+            for successor in self.successors[stack.pop()]:
+                if successor is end:
+                    return True
+                if successor not in seen and self._position[successor] < limit:
+                    seen.add(successor)
+                    stack.append(successor)
+        return False
+
+    def add_edge(self, edge):
+        """Raises ValueError if it would make a cycle, check with reaches(edge.output, edge.input) first"""
+        source, target = edge.input, edge.output
+        if self._position[source] > self._position[target]:
+            self._reorder(source, target)
+        elif source is target:
+            raise ValueError(f"{source} can't feed itself")
+
+        self.edges[edge.id] = edge
+        for attribute in (edge.input_attribute_id, edge.output_attribute_id):
+            self.edges_by_attribute.setdefault(attribute, set()).add(edge.id)
+        self._links[source, target] += 1
+        self._out_degree[source] += 1
+        self.successors[source].add(target)
+        self.predecessors[target].add(source)
+
+        if target in self.visible and source not in self.visible:
+            self._mark_visible(source)
+
+    def remove_edge(self, edge_id):
+        """Returns the edge that was removed"""
+        edge = self.edges.pop(edge_id)
+        source, target = edge.input, edge.output
+        for attribute in (edge.input_attribute_id, edge.output_attribute_id):
+            edge_ids = self.edges_by_attribute[attribute]
+            edge_ids.discard(edge_id)
+            if not edge_ids:
+                del self.edges_by_attribute[attribute]
+        self._out_degree[source] -= 1
+        self._links[source, target] -= 1
+        if self._links[source, target]:
+            return edge
+
+        del self._links[source, target]
+        self.successors[source].discard(target)
+        self.predecessors[target].discard(source)
+        if source in self.visible and not self.is_sink(source):
+            self._update_visible(source)
+        return edge
+
+    def _reorder(self, source, target):
+        """source has to come before target, but doesn't. Moves what's in between so it does"""
+        lower, upper = self._position[target], self._position[source]
+
+        forward = {target}
+        stack = [target]
+        while stack:
+            for successor in self.successors[stack.pop()]:
+                if successor is source:
+                    raise ValueError(f"Linking {source} to {target} makes a cycle")
+                if successor not in forward and self._position[successor] < upper:
+                    forward.add(successor)
+                    stack.append(successor)
+
+        backward = {source}
+        stack = [source]
+        while stack:
+            for predecessor in self.predecessors[stack.pop()]:
+                if predecessor not in backward and self._position[predecessor] > lower:
+                    backward.add(predecessor)
+                    stack.append(predecessor)
+
+        # everything that leads to source goes first, then everything target leads to, in the slots they had between them
+        moved = sorted(backward, key=self._position.__getitem__) + sorted(
+            forward, key=self._position.__getitem__
+        )
+        slots = sorted(self._position[node] for node in moved)
+        for node, slot in zip(moved, slots):
+            self._position[node] = slot
+        self._order = None
+        logger.debug(f"Moved {len(moved)} nodes to put {source} before {target}")
+
+    def _mark_visible(self, node):
+        stack = [node]
+        self.visible.add(node)
+        while stack:
+            for predecessor in self.predecessors[stack.pop()]:
+                if predecessor not in self.visible:
+                    self.visible.add(predecessor)
+                    stack.append(predecessor)
+
+    def _update_visible(self, node):
+        """node lost a successor, so it and whatever feeds it might not reach a sink anymore"""
+        affected = {node}
+        stack = [node]
+        while stack:
+            for predecessor in self.predecessors[stack.pop()]:
+                if (
+                    predecessor not in affected
+                    and predecessor in self.visible
+                    and not self.is_sink(predecessor)
+                ):
+                    affected.add(predecessor)
+                    stack.append(predecessor)
+        self.visible -= affected
+        # successors come later in the order, so they are settled by the time their predecessors are looked at
+        for current in sorted(affected, key=self._position.__getitem__, reverse=True):
+            if any(successor in self.visible for successor in self.successors[current]):
+                self.visible.add(current)
@@ -1,11 +1,16 @@
+import contextlib
+import functools
 import itertools
 import logging
+from dataclasses import dataclass
 
 import numpy as np
 from line_profiler import profile
 from PIL import Image as PImage
 from PIL import ImageMath
 
+from .arena import scratch
+
 logger = logging.getLogger("Core.ImageOps")
 
 
@@ -17,58 +22,373 @@ def get_rgb_histogram(image: PImage.Image):
     return image.convert("L").histogram()
 
 
-def split_rgb(image: PImage.Image):
-    r, g, b, a = (np.array(channel) for channel in image.split())
-    zeros = np.zeros_like(r)
-    r_out = PImage.fromarray(
-        np.stack([r, zeros, zeros], axis=2),
-        "RGB",
-    )
-    g_out = PImage.fromarray(np.stack([zeros, g, zeros], axis=2), "RGB")
-    b_out = PImage.fromarray(np.stack([zeros, zeros, b], axis=2), "RGB")
-    return r_out, g_out, b_out
+def to_texture(image: PImage.Image | np.ndarray, out: np.ndarray | None = None):
+    """
+    RGBA pixels as the flat float32 array dearpygui textures take. Written into `out` if it is the right size, so that
+    something that uploads every frame can keep reusing one buffer. Images without alpha are opaque, grey ones are
+    spread over the three colour bands.
+    """
+    arr = np.asarray(image)
+    height, width = arr.shape[:2]
+    if out is None or out.size != width * height * 4:
+        out = np.empty(width * height * 4, dtype=np.float32)
+    texture = out.reshape(height, width, 4)
+    if arr.ndim == 2:
+        arr = arr[..., np.newaxis]
+    if arr.shape[2] == 4:
+        np.divide(arr, 255, out=texture, dtype=np.float32)
+    else:
+        np.divide(arr[..., :3], 255, out=texture[..., :3], dtype=np.float32)
+        texture[..., 3] = 1
+    return out
 
 
-def merge(images):
-    np_images = np.array(
-        list(np.array(image, dtype=np.float32) / 255 for image in images)
-    )
-    combined = np.sum(np_images, axis=0)
-    combined = np.clip(combined, 0, 1)
-    combined *= 255
-    return PImage.fromarray(combined.astype(np.uint8), "RGBA")
+def identity_lut():
+    return np.tile(np.arange(256, dtype=np.uint8), (3, 1))
+
+
+def compose_luts(first, second):
+    """
+    Returns the 3x256 table that does `first` and then `second`. `first` can be None, meaning nothing is pending yet.
+    Since every node rounds to uint8 anyway, the composed table is exactly what running both passes would give.
+    """
+    if first is None:
+        return second
+    return np.take_along_axis(second, first.astype(np.intp), axis=1)
+
+
+def apply_lut(image: PImage.Image, lut) -> PImage.Image:
+    """Applies a 3x256 table to the colour bands in one pass, any other band (alpha) is left alone"""
+    table = []
+    for band in range(len(image.getbands())):
+        table.extend(lut[band] if band < 3 else range(256))
+    return image.point([int(value) for value in table])
+
+
+@functools.cache
+def _ramp():
+    # one pixel of every value, run the real Pillow op through this and you get its lookup table for free
+    return PImage.frombytes("L", (256, 1), bytes(range(256)))
+
+
+def _blend_lut(degenerate_value, factor):
+    # this is what ImageEnhance does: blend the image with a "degenerate" version of itself
+    ramp = _ramp()
+    degenerate = PImage.new("L", ramp.size, degenerate_value)
+    table = np.asarray(PImage.blend(degenerate, ramp, factor))[0]
+    return np.tile(table, (3, 1))
+
 
+def brightness_lut(factor):
+    """Same as ImageEnhance.Brightness, as a table"""
+    return _blend_lut(0, factor)
 
-def split_smh(image: PImage.Image):
-    arr = np.asarray(image.convert("RGB"), dtype=np.float32) / 255.0
-    image_YCbCr = image.convert("YCbCr")
-    luminance = np.asarray(image_YCbCr.split()[0], dtype=np.float32) / 255.0
+
+def contrast_lut(factor, mean):
+    """Same as ImageEnhance.Contrast, as a table. `mean` is the mean luma of the image it is applied to."""
+    return _blend_lut(int(mean + 0.5), factor)
+
+
+def levels_lut(black, white, gamma):
+    arr = np.arange(256, dtype=np.float32) / 255
+    arr = (arr - black) / (white - black)
+    arr = np.power(arr, 1 / gamma)
+    arr = arr * 255
+    arr = np.clip(arr, 0, 255)
+    return np.tile(arr.astype(np.uint8), (3, 1))
+
+
+def get_mean(histogram):
+    histogram = np.asarray(histogram)
+    return histogram @ np.arange(256) / histogram.sum()
+
+
+def get_mean_luma(histogram, lut):
+    """
+    Mean of image.convert("L") after `lut` has been applied, given the per band histogram of the image. It uses the same
+    weights as Pillow's L conversion (minus its per pixel rounding), so the intermediate image never has to exist.
+    """
+    histogram = np.asarray(histogram[:768]).reshape(3, 256)
+    means = (histogram * lut).sum(axis=1) / histogram[0].sum()
+    return means @ (0.299, 0.587, 0.114)
+
+
+def get_lut_histogram(image: PImage.Image, lut, max_size=256):
+    """
+    Luma histogram of `image` after `lut`. This is estimated on a reduced copy, so that fused chains never have to build
+    the intermediate image at full size. Only the shape is right, the counts are smaller.
+    """
+    factor = max(1, max(image.size) // max_size)
+    small = image.reduce(factor) if factor > 1 else image
+    return get_rgb_histogram(apply_lut(small, lut))
+
+
+@functools.cache
+def _band_to_grey():
+    # what Pillow's L conversion makes of every value of one band when the other two are 0
+    ramp = np.zeros((3, 256, 3), dtype=np.uint8)
+    for band in range(3):
+        ramp[band, :, band] = np.arange(256)
+    return np.asarray(PImage.fromarray(ramp, "RGB").convert("L"))
+
+
+@dataclass(frozen=True, eq=False)
+class ChannelView:
+    """
+    A single colour band of an image, standing in for the zero padded RGBA image it logically is. `plane` is usually a
+    view into the array of the image it came from.
+    """
+
+    plane: np.ndarray
+    band: int
+
+    def expand(self) -> PImage.Image:
+        arr = np.zeros(self.plane.shape + (4,), dtype=np.uint8)
+        arr[..., self.band] = self.plane
+        arr[..., 3] = 255
+        return PImage.fromarray(arr, "RGBA")
+
+    def histogram(self):
+        """Same as expand().histogram()"""
+        plane = np.bincount(self.plane.ravel(), minlength=256)
+        empty = np.zeros(256, dtype=np.int64)
+        empty[0] = self.plane.size
+        opaque = np.zeros(256, dtype=np.int64)
+        opaque[255] = self.plane.size
+        bands = [empty, empty, empty, opaque]
+        bands[self.band] = plane
+        return np.concatenate(bands).tolist()
+
+    def grey_histogram(self):
+        """Same as expand().convert("L").histogram()"""
+        plane = np.bincount(self.plane.ravel(), minlength=256)
+        grey = _band_to_grey()[self.band]
+        return np.bincount(grey, weights=plane, minlength=256).astype(int).tolist()
+
+    def apply_lut(self, lut):
+        """
+        Returns the view after `lut`, or None if the lut doesn't map 0 to 0 in the other bands (then the result isn't a
+        single band anymore and the caller has to expand it)
+        """
+        if any(lut[band][0] for band in range(3) if band != self.band):
+            return None
+        return ChannelView(lut[self.band][self.plane], self.band)
+
+
+def split_rgb(image: PImage.Image | np.ndarray):
+    # at most one copy of the image, all three views share it
+    arr = np.asarray(image)
+    return tuple(ChannelView(arr[..., band], band) for band in range(3))
+
+
+MERGE_MODES = ("Add", "Screen", "Multiply", "Lighten", "Darken")
+
+
+def _screen(acc, layer, out):
+    # 1 - (1 - acc) * (1 - layer), without temporaries
+    np.subtract(1, layer, out=layer)
+    np.subtract(1, acc, out=out)
+    out *= layer
+    np.subtract(1, out, out=out)
+
+
+# blend(acc, layer, out) writes the blended pixels into out, and is allowed to change layer
+_BLEND_MODES = {
+    "Add": lambda acc, layer, out: np.add(acc, layer, out=out),
+    "Screen": _screen,
+    "Multiply": lambda acc, layer, out: np.multiply(acc, layer, out=out),
+    "Lighten": lambda acc, layer, out: np.maximum(acc, layer, out=out),
+    "Darken": lambda acc, layer, out: np.minimum(acc, layer, out=out),
+}
+
+
+def merge(images, weights=None, mode="Add"):
+    """
+    Blends the images together one at a time into a single accumulator, so peak memory doesn't depend on how many
+    images there are and `images` can be a generator that is only consumed as we go. The accumulator and the other
+    temporaries are borrowed from the scratch arena.
+
+    Args:
+        images: RGBA images or ChannelViews, all the same size
+        weights: How much of each image goes in. With "Add" it's a weighted sum, with the other modes it's the opacity
+            each image is blended onto the ones before it with (the first one is the base layer and is used as is).
+            None means 1 for everything.
+        mode: One of MERGE_MODES
+
+    Returns:
+        PImage.Image
+    """
+    if weights is None:
+        if mode in ("Add", "Lighten", "Darken"):
+            return _merge_uint8(images, mode)
+        weights = itertools.repeat(1)
+
+    blend = _BLEND_MODES[mode]
+    with contextlib.ExitStack() as buffers:
+        acc = None
+        layer = None
+        blended = None
+        for image, weight in zip(images, weights):
+            if isinstance(image, ChannelView) and mode == "Add":
+                # only one band (and the alpha) of a view can change anything
+                if acc is None:
+                    acc = buffers.enter_context(
+                        scratch.borrow(image.plane.shape + (4,))
+                    )
+                    acc.fill(0)
+                if blended is None:
+                    blended = buffers.enter_context(scratch.borrow(image.plane.shape))
+                np.multiply(image.plane, weight / 255, out=blended, dtype=np.float32)
+                band = acc[..., image.band]
+                band += blended
+                acc[..., 3] += weight
+                continue
+            arr = _rgba_array(image)
+            if layer is None:
+                layer = buffers.enter_context(scratch.borrow(arr.shape))
+            np.divide(arr, 255, out=layer)
+            if acc is None:
+                acc = buffers.enter_context(scratch.borrow(arr.shape))
+                if mode == "Add":
+                    np.multiply(layer, weight, out=acc)
+                else:
+                    np.copyto(acc, layer)
+            elif mode == "Add":
+                layer *= weight
+                acc += layer
+            else:
+                if blended is None or blended.shape != arr.shape:
+                    blended = buffers.enter_context(scratch.borrow(arr.shape))
+                blend(acc, layer, blended)
+                blended -= acc
+                blended *= weight
+                acc += blended
+        if acc is None:
+            raise ValueError("There is nothing to merge")
+
+        np.clip(acc, 0, 1, out=acc)
+        acc *= 255
+        return PImage.fromarray(acc.astype(np.uint8), "RGBA")
+
+
+def _rgba_array(image: PImage.Image | ChannelView):
+    if isinstance(image, ChannelView):
+        image = image.expand()
+    if image.mode != "RGBA":
+        image = image.convert("RGBA")
+    return np.asarray(image)
+
+
+def _merge_uint8(images, mode):
+    # integer only version of the common case, a uint16 accumulator that saturates after every add
+    with contextlib.ExitStack() as buffers:
+        acc = None
+        for image in images:
+            if isinstance(image, ChannelView) and mode == "Add":
+                if acc is None:
+                    acc = buffers.enter_context(
+                        scratch.borrow(image.plane.shape + (4,), np.uint16)
+                    )
+                    acc.fill(0)
+                band = acc[..., image.band]
+                np.add(band, image.plane, out=band)
+                np.minimum(band, 255, out=band)
+                acc[..., 3] = 255
+                continue
+            arr = _rgba_array(image)
+            if acc is None:
+                acc = buffers.enter_context(scratch.borrow(arr.shape, np.uint16))
+                np.copyto(acc, arr)
+            elif mode == "Add":
+                np.add(acc, arr, out=acc)
+                np.minimum(acc, 255, out=acc)
+            elif mode == "Lighten":
+                np.maximum(acc, arr, out=acc)
+            else:
+                np.minimum(acc, arr, out=acc)
+        if acc is None:
+            raise ValueError("There is nothing to merge")
+        return PImage.fromarray(acc.astype(np.uint8), "RGBA")
+
+
+@functools.cache
+def luminance_masks():
+    """
+    Shadow, midtone and highlight weights (3x256) for every 8 bit luma value. The masks only depend on luma, so they are
+    worked out once here and looked up per pixel instead of being evaluated over the whole image.
+    """
+    luminance = np.arange(256, dtype=np.float32) / 255.0
 
     a = 0.25
     b = 0.333
 
-    # Compute masks
     mask_shadows = np.clip((luminance - b) / -a + 0.5, 0, 1)
     mask_midtones = np.clip((luminance - b) / a + 0.5, 0, 1) * np.clip(
         (luminance + b - 1) / -a + 0.5, 0, 1
     )
     mask_highlights = np.clip((luminance + b - 1) / a + 0.5, 0, 1)
 
-    shadows = arr * mask_shadows[..., np.newaxis]
-    shadows = np.clip(shadows, 0, 1)
-    shadows *= 255
-
-    midtones = arr * mask_midtones[..., np.newaxis]
-    midtones = np.clip(midtones, 0, 1)
-    midtones *= 255
-
-    highlights = arr * mask_highlights[..., np.newaxis]
-    highlights = np.clip(highlights, 0, 1)
-    highlights *= 255
-
-    shadow_image = PImage.fromarray(shadows.astype(np.uint8), "RGB")
-    midtone_image = PImage.fromarray(midtones.astype(np.uint8), "RGB")
-    highlight_image = PImage.fromarray(highlights.astype(np.uint8), "RGB")
+    masks = np.stack([mask_shadows, mask_midtones, mask_highlights])
+    masks.flags.writeable = False
+    return masks
+
+
+def gather(tables, luminance, rgb, outs=None):
+    """
+    For every table stack (3x256x256, indexed by channel, luma and value) returns an HxWx3 uint8 image of
+    table[channel, luma, value]. This is how the luma based kernels touch every pixel exactly once.
+
+    `rgb` can have more than 3 bands (RGBA), only the first 3 are read. The images are written into `outs` if it is
+    given, the indices are worked out in scratch buffers.
+    """
+    if outs is None:
+        outs = [np.empty(rgb.shape[:2] + (3,), dtype=np.uint8) for _ in tables]
+    # np.take converts any other index type to intp (a fresh array the size of the image, every call)
+    with scratch.borrow(luminance.shape, np.uint16) as base, scratch.borrow(
+        luminance.shape, np.intp
+    ) as index, scratch.borrow(luminance.shape, np.uint8) as plane:
+        np.left_shift(luminance, 8, out=base, dtype=np.uint16)
+        for channel in range(3):
+            np.bitwise_or(base, rgb[..., channel], out=index)
+            for out, table in zip(outs, tables):
+                # taking straight into the strided channel makes numpy buffer a copy of the whole thing
+                np.take(table[channel].ravel(), index, out=plane, mode="clip")
+                np.copyto(out[..., channel], plane)
+    return outs
+
+
+def _rgb_array(image: PImage.Image):
+    # RGBA is read as is, gather skips the alpha
+    if image.mode not in ("RGB", "RGBA"):
+        image = image.convert("RGB")
+    return np.asarray(image)
+
+
+@functools.cache
+def split_smh_tables():
+    values = np.arange(256, dtype=np.float32) / 255.0
+    tables = []
+    for mask in luminance_masks():
+        table = values[np.newaxis, :] * mask[:, np.newaxis]
+        table = np.clip(table, 0, 1)
+        table *= 255
+        table = np.tile(table.astype(np.uint8), (3, 1, 1))
+        table.flags.writeable = False
+        tables.append(table)
+    return tables
+
+
+def split_smh(image: PImage.Image, luminance=None):
+    """`luminance` is the Y plane of the image, if you already have it"""
+    arr = _rgb_array(image)
+    if luminance is None:
+        luminance = np.asarray(image.convert("YCbCr").getchannel(0))
+
+    shadows, midtones, highlights = gather(split_smh_tables(), luminance, arr)
+
+    shadow_image = PImage.fromarray(shadows, "RGB")
+    midtone_image = PImage.fromarray(midtones, "RGB")
+    highlight_image = PImage.fromarray(highlights, "RGB")
 
     return shadow_image, midtone_image, highlight_image
 
@@ -80,50 +400,61 @@ def add(image, dx):
     return image.convert("L")
 
 
-def colour_balance(
-    img: PImage.Image,
+@functools.lru_cache(maxsize=16)
+def colour_balance_table(
     shadows: tuple[float, float, float],
     midtones: tuple[float, float, float],
     highlights: tuple[float, float, float],
-    preserve_luminance: bool = False,
-) -> PImage.Image:
-    # inspired by GIMP's algorithm but uses luminance instead of lightness
-    # https://gitlab.gnome.org/GNOME/gimp/-/blob/master/app/operations/gimpoperationcolorbalance.c
-
-    arr = np.asarray(img.convert("RGB"), dtype=np.float32) / 255.0
-    image_YCbCr = img.convert("YCbCr")
-    luminance = np.asarray(image_YCbCr.split()[0], dtype=np.float32) / 255.0
-
+):
+    """
+    The whole colour balance as a 3x256x256 table indexed by channel, luma and value. Small enough to rebuild on every
+    slider tick, and a drag that lands back on an old value gets it for free.
+    """
     # Convert input corrections from [-100,100] to [-1,1]
     s = np.array(shadows) / 100.0
     m = np.array(midtones) / 100.0
     h = np.array(highlights) / 100.0
 
-    a = 0.25
-    b = 0.333
     scale = 0.7
+    mask_shadows, mask_midtones, mask_highlights = luminance_masks() * scale
 
-    # Compute masks
-    mask_shadows = np.clip((luminance - b) / -a + 0.5, 0, 1) * scale
-    mask_midtones = (
-        np.clip((luminance - b) / a + 0.5, 0, 1)
-        * np.clip((luminance + b - 1) / -a + 0.5, 0, 1)
-        * scale
-    )
-    mask_highlights = np.clip((luminance + b - 1) / a + 0.5, 0, 1) * scale
+    # every adjustment is a function of (channel, luma) and the value is the last axis
+    shadows_adjustment = np.multiply.outer(s, mask_shadows)[..., np.newaxis]
+    midtones_adjustment = np.multiply.outer(m, mask_midtones)[..., np.newaxis]
+    highlights_adjustment = np.multiply.outer(h, mask_highlights)[..., np.newaxis]
 
-    shadows_adjustment = mask_shadows[..., np.newaxis] * s
-    midtones_adjustment = mask_midtones[..., np.newaxis] * m
-    highlights_adjustment = mask_highlights[..., np.newaxis] * h
+    values = np.arange(256, dtype=np.float32) / 255.0
+    table = values + shadows_adjustment + midtones_adjustment + highlights_adjustment
+    table = np.clip(table, 0, 1)
+    table *= 255
+    table = table.astype(np.uint8)
+    table.flags.writeable = False
+    return table
 
-    arr = arr + shadows_adjustment + midtones_adjustment + highlights_adjustment
-    arr = np.clip(arr, 0, 1)
-    arr *= 255
-    out = PImage.fromarray(arr.astype(np.uint8), "RGB")
+
+def colour_balance(
+    img: PImage.Image,
+    shadows: tuple[float, float, float],
+    midtones: tuple[float, float, float],
+    highlights: tuple[float, float, float],
+    preserve_luminance: bool = False,
+    luminance=None,
+) -> PImage.Image:
+    """`luminance` is the Y plane of the image, if you already have it"""
+    # inspired by GIMP's algorithm but uses luminance instead of lightness
+    # https://gitlab.gnome.org/GNOME/gimp/-/blob/master/app/operations/gimpoperationcolorbalance.c
+
+    arr = _rgb_array(img)
+    if luminance is None:
+        luminance = np.asarray(img.convert("YCbCr").getchannel(0))
+
+    table = colour_balance_table(tuple(shadows), tuple(midtones), tuple(highlights))
+    (arr,) = gather([table], luminance, arr)
+    out = PImage.fromarray(arr, "RGB")
 
     if preserve_luminance:
         out_y, out_cb, out_cr = out.convert("YCbCr").split()
-        in_y = image_YCbCr.split()[0]
+        in_y = PImage.fromarray(np.ascontiguousarray(luminance))
         out = PImage.merge("YCbCr", [in_y, out_cb, out_cr])
         out = out.convert("RGB")
 
@@ -132,10 +463,4 @@ def colour_balance(
 
 @profile
 def levels(img: PImage.Image, black, white, gamma):
-    arr = np.asarray(img, dtype=np.float32) / 255
-    arr = (arr - black) / (white - black)
-    arr = np.power(arr, 1 / gamma)
-    arr = arr * 255
-    arr = np.clip(arr, 0, 255)
-    out = PImage.fromarray(arr.astype(np.uint8), "RGBA")
-    return out
+    return apply_lut(img, levels_lut(black, white, gamma))
@@ -5,17 +5,52 @@ This can be extended to receiving images from the DoPy server when it becomes a
 
 import functools
 import logging
+import math
 from pathlib import Path
-from typing import Literal, Tuple
+from typing import Callable, Literal, Tuple
 
 import numpy as np
 import PIL.Image as PImage
 import PIL.ImageOps as PImageOps
 
-from .utils import ShittyMultiThreading
+from .cache import image_cache, sizeof
+from .disk_cache import disk_cache
+from .image_processing import ChannelView, apply_lut, get_rgb_histogram, to_texture
+from .prefetch import Prefetcher
+from .tiling import map_tiles
 
 logger = logging.getLogger("Core.Images")
 
+# (left, top, right, bottom) as fractions of the width and height of the whole frame
+Region = Tuple[float, float, float, float]
+FULL_FRAME: Region = (0.0, 0.0, 1.0, 1.0)
+
+# levels below this one are small enough to be worth keeping on disk, a quarter of the size is 1/16 of the pixels
+MIN_DISK_LEVEL = 2
+
+
+class cached_buffer:
+    """
+    Like functools.cached_property, but goes through Image.memo, so images that come from a file keep the value in
+    image_cache under `category` instead of holding on to it themselves
+    """
+
+    def __init__(self, category: str):
+        self.category = category
+
+    def __call__(self, func):
+        self.func = func
+        self.__doc__ = func.__doc__
+        return self
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner=None):
+        if instance is None:
+            return self
+        return instance.memo((self.name,), self.category, lambda: self.func(instance))
+
 
 class Image:
     """
@@ -23,55 +58,342 @@ class Image:
     directly, so this converts the image into a numpy array that dearpygui can display as a texture. The image is also padded
     with black borders if it's aspect ratio doesn't fit the ImageWindow.
 
+    Images are immutable, so one can be shared by any number of edges and caches. The pixels can be given as a
+    PImage.Image or as a uint8 array (HxW, HxWx3 or HxWx4), either is wrapped as is, without a copy. Nothing gets an
+    alpha band added, an image without one is opaque.
+
+    Everything worked out from the pixels (textures, luma, histograms, ...) is computed the first time something asks for
+    it and then shared by every node that gets this Image. Images made with frompath don't hold on to any of it, it
+    lives in image_cache (see cache.py) so that long sessions stay inside the memory budget.
+
     Attributes:
         name: The name of the image file
-        raw_image: PImage.Image object
+        raw_image: PImage.Image object (made from the array the first time it is asked for, if that is what was given)
         dpg_texture: A scaled image that is shown in the bigger display, stored in a form that dearpygui accepts
         thumbnail: A scaled thumbnail that is shown in the preview displays, stored in a form that dearpygui accepts
+        array: The pixels as a read only uint8 array
+        ycbcr: The pixels in YCbCr as a read only uint8 array
+        luma: The Y plane of ycbcr
+        histogram: Per band histogram, like PImage.Image.histogram
+        grey_histogram: Histogram of the image converted to L, which is what ImageEnhance works from and the nodes show
+        region: Which part of the frame this is, as (left, top, right, bottom) fractions (see crop)
     """
 
     def __init__(
         self,
         name: str,
-        raw_image: PImage.Image,
+        raw_image: PImage.Image | np.ndarray | None,
         main_image_dimensions,
         thumbnail_dimensions,
+        path: Path | None = None,
+        size: Tuple[int, int] | None = None,
+        cache_key: tuple | None = None,
+        region: Region = FULL_FRAME,
     ) -> None:
         self.name = name
-        self.raw_image = raw_image
-        self.raw_image.putalpha(255)
+        self.path = path
+        self._raw_image = None
+        self._array = None
+        self._size = size
+        if isinstance(raw_image, np.ndarray):
+            # a view, so that this image can't write to it, but whoever made the array still can (and shouldn't)
+            self._array = raw_image.view()
+            self._array.flags.writeable = False
+            self._size = (raw_image.shape[1], raw_image.shape[0])
+        elif raw_image is not None:
+            self._raw_image = raw_image
+            self._size = raw_image.size
+        self.cache_key = cache_key
+        self.region = region
         self.main_image_dimensions = main_image_dimensions
         self.thumbnail_dimensions = thumbnail_dimensions
 
+    @property
+    def raw_image(self) -> PImage.Image:
+        if self._raw_image is not None:
+            return self._raw_image
+        if self._array is not None:
+            # shares the array's memory for L and RGBA, Pillow copies RGB
+            self._raw_image = PImage.fromarray(self._array)
+            return self._raw_image
+        if self.cache_key is None:
+            self._raw_image = self.decode()
+            return self._raw_image
+        return self.memo(("raw_image",), "full", self.decode)
+
+    @property
+    def pixels(self) -> PImage.Image | np.ndarray:
+        """Whichever of the array or raw_image is at hand, for kernels (like to_texture) that take either"""
+        return self._array if self._array is not None else self.raw_image
+
+    @property
+    def size(self) -> Tuple[int, int]:
+        """(width, height), images that come from a file know this without decoding anything"""
+        if self._size is None:
+            self._size = self.raw_image.size
+        return self._size
+
+    @property
+    def nbytes(self):
+        if self._array is not None:
+            return self._array.nbytes
+        if self._raw_image is not None:
+            return sizeof(self._raw_image)
+        # decoded files are RGB, unless they have transparency
+        width, height = self.size
+        return width * height * 3
+
+    def decode(self, size: Tuple[int, int] | None = None) -> PImage.Image:
+        """
+        Reads the pixels from self.path. If a `size` is given, JPEGs are decoded straight to the smallest of 1/2, 1/4 or
+        1/8 of their size that is still at least that big (the DCT does the downscaling, so this costs a fraction of a
+        full decode). Other formats just ignore it.
+        """
+        logger.debug(f"Decoding {self.path} at {size or 'full size'}")
+        raw_image = PImage.open(self.path)
+        if size is not None:
+            raw_image.draft("RGB", size)
+        raw_image.load()
+        if raw_image.mode not in ("RGB", "RGBA"):
+            # kernels expect colour, and only images that are actually transparent get an alpha band
+            has_alpha = "A" in raw_image.getbands() or "transparency" in raw_image.info
+            raw_image = raw_image.convert("RGBA" if has_alpha else "RGB")
+        return raw_image
+
     @functools.cached_property
+    def memos(self) -> dict:
+        return {}
+
+    def memo(self, key: tuple, category: str, factory: Callable):
+        """
+        Returns factory(), worked out once. Images that come from a file keep the result in the byte budgeted
+        image_cache (so it can be evicted and made again later), everything else keeps it for as long as it lives.
+        """
+        if self.cache_key is None:
+            if key not in self.memos:
+                self.memos[key] = factory()
+            return self.memos[key]
+        return image_cache.get_or_create((*self.cache_key, *key), category, factory)
+
+    def persist(self, key: tuple, factory: Callable[[], np.ndarray]) -> np.ndarray:
+        """Like memo, but the uint8 array factory() makes is also kept on disk (see disk_cache.py) for next time"""
+        if self.cache_key is None:
+            return factory()
+        return disk_cache.get_or_create((*self.cache_key, *key), factory)
+
+    @cached_buffer("texture")
     def dpg_texture(self):
         dpg_texture = PImageOps.pad(
-            self.raw_image, self.main_image_dimensions, color="#000000"
+            self.get_proxy(self.main_image_dimensions).raw_image,
+            self.main_image_dimensions,
+            color="#000000",
         )
-        return np.frombuffer(dpg_texture.tobytes(), dtype=np.uint8) / 255.0
+        return to_texture(dpg_texture)
 
-    @functools.cached_property
+    @cached_buffer("thumbnail")
     def thumbnail(self):
-        thumbnail = PImageOps.pad(
-            self.raw_image, self.thumbnail_dimensions, color="#000000"
+        thumbnail = self.persist(
+            ("thumbnail", self.thumbnail_dimensions),
+            lambda: np.asarray(
+                PImageOps.pad(
+                    self.get_proxy(self.thumbnail_dimensions).raw_image,
+                    self.thumbnail_dimensions,
+                    color="#000000",
+                )
+            ),
         )
-        return np.frombuffer(thumbnail.tobytes(), dtype=np.uint8) / 255.0
+        return to_texture(thumbnail)
 
-    @functools.cached_property
+    @cached_buffer("texture")
     def dpg_raw(self):
-        return np.frombuffer(self.raw_image.tobytes(), dtype=np.uint8) / 255.0
+        return to_texture(self.raw_image)
 
-    @functools.cache
-    def get_scaled_image(self, factor=0.15):
+    def get_texture(self, size: tuple[int, int], out: np.ndarray | None = None):
+        """
+        The smallest proxy that fills a widget of `size` (see get_proxy) as a texture, so a full resolution image never
+        gets converted pixel by pixel just to be shown in a 400x300 plot.
+
+        Returns:
+            (width, height) of the texture, and the texture (written into out if it fits)
+        """
+        proxy = self.get_proxy(size)
+        return proxy.size, to_texture(proxy.pixels, out)
+
+    @property
+    def layer(self):
+        """What kernels that know about ChannelViews (merge) should be given"""
+        return self.raw_image
+
+    @cached_buffer("derived")
+    def array(self):
+        if self._array is not None:
+            return self._array
+        return np.asarray(self.raw_image)
+
+    @cached_buffer("derived")
+    def ycbcr(self):
+        return np.asarray(self.raw_image.convert("YCbCr"))
+
+    @property
+    def luma(self):
+        return self.ycbcr[..., 0]
+
+    @cached_buffer("derived")
+    def histogram(self):
+        return self.raw_image.histogram()
+
+    @cached_buffer("derived")
+    def grey_histogram(self):
+        return get_rgb_histogram(self.raw_image)
+
+    def derive(self, raw_image: PImage.Image | np.ndarray, name="NA") -> "Image":
+        """A new Image of the same part of the frame, for what a node makes out of this one"""
         return Image(
-            f"{self.name}_{factor:.2f}",
-            PImageOps.scale(self.raw_image, factor),
+            name,
+            raw_image,
             self.main_image_dimensions,
             self.thumbnail_dimensions,
+            region=self.region,
+        )
+
+    def crop(self, region: Region, padding=0) -> "Image":
+        """
+        The part of this image that covers `region` of the frame, plus `padding` pixels around it for nodes that look
+        at neighbours. Edges are rounded outwards to whole pixels, the region of what comes back is exact.
+        """
+        width, height = self.size
+        left, top, right, bottom = self.region
+        scale_x, scale_y = width / (right - left), height / (bottom - top)
+        box = (
+            max(math.floor((region[0] - left) * scale_x) - padding, 0),
+            max(math.floor((region[1] - top) * scale_y) - padding, 0),
+            min(math.ceil((region[2] - left) * scale_x) + padding, width),
+            min(math.ceil((region[3] - top) * scale_y) + padding, height),
+        )
+        if box == (0, 0, width, height) or box[2] <= box[0] or box[3] <= box[1]:
+            return self
+        if self._array is not None:
+            # a view, no pixels are copied
+            cropped = self._array[box[1] : box[3], box[0] : box[2]]
+        else:
+            cropped = self.raw_image.crop(box)
+        return Image(
+            f"{self.name}_crop",
+            cropped,
+            self.main_image_dimensions,
+            self.thumbnail_dimensions,
+            region=(
+                left + box[0] / scale_x,
+                top + box[1] / scale_y,
+                left + box[2] / scale_x,
+                top + box[3] / scale_y,
+            ),
+        )
+
+    def apply_lut(self, lut):
+        return self.derive(
+            map_tiles(lambda image: apply_lut(image, lut), self.raw_image)
+        )
+
+    def get_pyramid_level(self, level: int) -> "Image":
+        """
+        Returns the image at 1/2**level of its size. Stops at the level where the image can't be halved anymore.
+        """
+        width, height = self.size
+        while level > 0 and min(width, height) >> level < 1:
+            level -= 1
+        if level == 0:
+            return self
+        return self.memo(
+            ("level", level), "proxy", lambda: self.make_pyramid_level(level)
+        )
+
+    def make_pyramid_level(self, level: int) -> "Image":
+        """
+        If the full size pixels haven't been decoded yet the level is decoded straight from the file (see decode),
+        otherwise it is made by reducing the closest level above it that has already been made.
+        """
+        if self.cache_key is not None and level >= MIN_DISK_LEVEL:
+            raw_image = self.persist(
+                ("level", level), lambda: np.asarray(self.reduce_to_level(level))
+            )
+        else:
+            raw_image = self.reduce_to_level(level)
+        return Image(
+            f"{self.name}_level{level}",
+            raw_image,
+            self.main_image_dimensions,
+            self.thumbnail_dimensions,
+            cache_key=self.cache_key and (*self.cache_key, "level", level),
+            region=self.region,
+        )
+
+    def reduce_to_level(self, level: int) -> PImage.Image:
+        width, height = self.size
+        target = (-(-width >> level), -(-height >> level))
+
+        raw_image = None
+        for finer in range(level - 1, 0, -1):
+            if self.cache_key is None:
+                cached = self.memos.get(("level", finer))
+            else:
+                cached = image_cache.peek((*self.cache_key, "level", finer))
+            if cached is not None:
+                raw_image = cached.raw_image
+                break
+        if raw_image is None:
+            raw_image = self._raw_image
+            if raw_image is None and self.cache_key is not None:
+                raw_image = image_cache.peek((*self.cache_key, "raw_image"))
+            if raw_image is None and self.path is not None:
+                raw_image = self.decode(target)
+            elif raw_image is None:
+                raw_image = self.raw_image
+
+        # every level is the one above it halved and rounded up, which is what reduce does, so going from the level we
+        # started at in one step gives exactly the target size
+        source_level = round(math.log2(width / raw_image.size[0]))
+        if level > source_level:
+            raw_image = raw_image.reduce(2 ** (level - source_level))
+        if raw_image.size != target:
+            # anything that isn't a level, like a decoder that rounds differently
+            raw_image = raw_image.resize(target, PImage.Resampling.BOX)
+        logger.debug(f"Made level {level} of {self.name} ({raw_image.size})")
+        return raw_image
+
+    def get_proxy_level(self, size: tuple[int, int]) -> int:
+        """
+        The smallest pyramid level that still has at least one pixel per screen pixel when it is fit into a widget of
+        `size` (width, height)
+        """
+        width, height = self.size
+        scale = min(size[0] / width, size[1] / height)
+        level = 0
+        while scale > 0 and 2 ** -(level + 1) >= scale:
+            level += 1
+        return level
+
+    def get_proxy(self, size: tuple[int, int]) -> "Image":
+        """The pyramid level for `size`, see get_proxy_level"""
+        return self.get_pyramid_level(self.get_proxy_level(size))
+
+    def get_scaled_image(self, factor=0.15):
+        width, height = self.size
+        size = (max(round(width * factor), 1), max(round(height * factor), 1))
+        return self.memo(
+            ("scaled", factor),
+            "proxy",
+            lambda: Image(
+                f"{self.name}_{factor:.2f}",
+                self.get_proxy(size).raw_image.resize(size, PImage.Resampling.BICUBIC),
+                self.main_image_dimensions,
+                self.thumbnail_dimensions,
+                cache_key=self.cache_key and (*self.cache_key, "scaled", factor),
+                region=self.region,
+            ),
         )
 
     @classmethod
-    @functools.lru_cache(maxsize=40)
     def frompath(
         cls,
         path: Path,
@@ -79,7 +401,8 @@ class Image:
         thumbnail_dimensions: Tuple[int, int],
     ):
         """
-        Creates an Image object from the path of the image.
+        Creates an Image object from the path of the image. This is cheap, the pixels (and everything worked out from
+        them) live in image_cache, keyed by the file, so every Image made from the same file shares them.
 
         Args:
             path (Path): Path to the image
@@ -89,15 +412,30 @@ class Image:
         """
         logger.debug(f"Making image from path: {str(path)}")
         """Makes an Image object from the specified Path"""
+        name = path.name
         try:
-            raw_image = PImage.open(path)
+            # this only reads the header, the pixels are decoded when (and at the size) something needs them
+            with PImage.open(path) as header:
+                size = header.size
+            stat = path.stat()
         except Exception:
             # I know that catching all exceptions is bad, but the range of errors is truly insane here
             logger.error(f"Something is seriously wrong with image: {str(path)}")
-            raw_image = PImage.open("./dopylogofinal.png")
+            path = Path("./dopylogofinal.png")
+            with PImage.open(path) as header:
+                size = header.size
+            stat = path.stat()
 
         logger.debug(f"Image made from path: {str(path)}")
-        return Image(path.name, raw_image, main_image_dimensions, thumbnail_dimensions)
+        return Image(
+            name,
+            None,
+            main_image_dimensions,
+            thumbnail_dimensions,
+            path=path,
+            size=size,
+            cache_key=(str(path.resolve()), stat.st_mtime_ns, stat.st_size),
+        )
 
     @classmethod
     @functools.lru_cache(maxsize=40)
@@ -114,6 +452,62 @@ class Image:
         raise NotImplemented
 
 
+class ChannelImage(Image):
+    """
+    An Image that is a single band of another one (see ChannelView). The zero padded RGBA image is only made if
+    something asks for raw_image, like a PreviewNode showing it. Merge and the lookup table nodes work on the band
+    directly.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        view: ChannelView,
+        main_image_dimensions,
+        thumbnail_dimensions,
+        region: Region = FULL_FRAME,
+    ) -> None:
+        self.name = name
+        self.view = view
+        self.path = None
+        self.cache_key = None
+        self.region = region
+        self._raw_image = None
+        self._array = None
+        self._size = (view.plane.shape[1], view.plane.shape[0])
+        self.main_image_dimensions = main_image_dimensions
+        self.thumbnail_dimensions = thumbnail_dimensions
+
+    @functools.cached_property
+    def raw_image(self):
+        logger.debug(f"Expanding channel view {self.name}")
+        return self.view.expand()
+
+    @property
+    def layer(self):
+        return self.view
+
+    @functools.cached_property
+    def histogram(self):
+        return self.view.histogram()
+
+    @functools.cached_property
+    def grey_histogram(self):
+        return self.view.grey_histogram()
+
+    def apply_lut(self, lut):
+        view = self.view.apply_lut(lut)
+        if view is None:
+            return super().apply_lut(lut)
+        return ChannelImage(
+            self.name,
+            view,
+            self.main_image_dimensions,
+            self.thumbnail_dimensions,
+            region=self.region,
+        )
+
+
 class ImageManager:
     """
     Does what the name suggests, creates Images. Regardless of wherever it is from, the interface stays the same
@@ -157,6 +551,27 @@ class ImageManager:
     def end_index(self):
         return len(self.images)
 
+    @functools.cached_property
+    def prefetcher(self) -> Prefetcher:
+        return Prefetcher(self.warm, self.end_index)
+
+    @property
+    def queue_depth(self) -> int:
+        """How many prefetch jobs are still waiting"""
+        return self.prefetcher.queue_depth
+
+    def warm(self, index, stage):
+        """Gets the `stage` (see prefetch.STAGES) of an image into image_cache"""
+        image = Image.frompath(
+            self.images[index], self.main_image_dimensions, self.thumbnail_dimensions
+        )
+        if stage == "thumbnail":
+            image.thumbnail
+        elif stage == "proxy":
+            image.dpg_texture
+        else:
+            image.raw_image
+
     def load(self, index):
         """
         Returns an Image object, given an index
@@ -168,6 +583,11 @@ class ImageManager:
 
         """
         logger.debug(f"Loading image {self.images[index]}")
+        self.current_index = self._check_index(index)
+        self.prefetcher.schedule(self.current_index)
+        return self._open(self.current_index)
+
+    def _check_index(self, index) -> int:
         if index >= self.end_index:
             print(self.end_index)
             logger.error(
@@ -179,7 +599,9 @@ class ImageManager:
                 f"Attempted to get image number < 1, defaulted to {self.end_index}"
             )
             index = self.end_index - 1
-        self.current_index = index
+        return index
+
+    def _open(self, index) -> "Image":
         image_path = self.images[index]
         return Image.frompath(
             image_path, self.main_image_dimensions, self.thumbnail_dimensions
@@ -187,10 +609,10 @@ class ImageManager:
 
     def load_in_background(self):
         """
-        Loads all the images in the background using ShittMultiThreading from utils.py
+        Starts prefetching the images around current_index (see Prefetcher), every load after this moves the window.
         This works because the images are cached.
         """
-        ShittyMultiThreading(self.load, range(self.end_index)).start()
+        self.prefetcher.schedule(self.current_index)
 
     def peek(self, index):
         """
@@ -201,10 +623,8 @@ class ImageManager:
 
         Returns: Image
         """
-        og = self.current_index
-        img = self.load(index)
-        self.current_index = og
-        return img
+        # doesn't go through load, so the prefetch window stays around current_index
+        return self._open(self._check_index(index))
 
     def next(self):
         """
@@ -0,0 +1,97 @@
+"""
+3D lookup tables. A graph that only changes colours is a function of RGB alone, so it can be sampled once on a lattice
+and then applied to any image in one interpolation pass, no matter how many nodes it has. Also reads and writes them as
+.cube files so that looks can move between machines (and other editors).
+"""
+
+import logging
+from pathlib import Path
+from typing import Callable, Iterable
+
+import numpy as np
+import PIL.Image as PImage
+from PIL import ImageFilter
+
+from .tiling import map_tiles
+
+logger = logging.getLogger("Core.LUTs")
+
+LUT_SIZES = (33, 65)
+
+
+def lattice_image(size: int) -> PImage.Image:
+    """
+    Every point of a size^3 RGB lattice as an RGB image. Red changes fastest, then green, then blue, which is the order
+    both Color3DLUT and .cube files use, so a transformed lattice can be read straight back as a table.
+    """
+    steps = np.round(np.linspace(0, 255, size)).astype(np.uint8)
+    b, g, r = np.meshgrid(steps, steps, steps, indexing="ij")
+    arr = np.stack([r, g, b], axis=-1).reshape(size * size, size, 3)
+    return PImage.fromarray(arr, "RGB")
+
+
+def bake(
+    transforms: Iterable[Callable[[PImage.Image], PImage.Image]], size=33
+) -> ImageFilter.Color3DLUT:
+    """
+    Samples a chain of colour transforms (PImage -> PImage functions that only look at the colour of each pixel) on a
+    size^3 lattice.
+    """
+    lattice = lattice_image(size)
+    for transform in transforms:
+        lattice = transform(lattice)
+    table = np.asarray(lattice.convert("RGB"), dtype=np.float32).reshape(-1) / 255
+    return ImageFilter.Color3DLUT(size, table)
+
+
+def apply_3d_lut(image: PImage.Image, lut: ImageFilter.Color3DLUT) -> PImage.Image:
+    """Trilinear interpolation through the table, alpha is left alone"""
+    return map_tiles(lambda strip: strip.filter(lut), image)
+
+
+def read_cube(path: Path) -> ImageFilter.Color3DLUT:
+    """
+    Reads an Adobe/Resolve style .cube file. Only 3D tables over the default [0, 1] domain are supported.
+    """
+    size = None
+    table = []
+    with open(path) as file:
+        for line in file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            keyword, *values = line.split()
+            if keyword == "LUT_3D_SIZE":
+                size = int(values[0])
+            elif keyword == "LUT_1D_SIZE":
+                raise ValueError(f"{path} is a 1D LUT, only 3D ones are supported")
+            elif keyword in ("DOMAIN_MIN", "DOMAIN_MAX"):
+                expected = 0.0 if keyword == "DOMAIN_MIN" else 1.0
+                if any(float(value) != expected for value in values):
+                    raise ValueError(f"{path} has a custom {keyword}, not supported")
+            elif keyword == "TITLE":
+                continue
+            else:
+                table.extend(float(value) for value in (keyword, *values))
+
+    if size is None:
+        raise ValueError(f"{path} has no LUT_3D_SIZE")
+    if len(table) != size**3 * 3:
+        raise ValueError(
+            f"{path} should have {size ** 3} entries but has {len(table) // 3}"
+        )
+    logger.debug(f"Read {size}^3 LUT from {path}")
+    return ImageFilter.Color3DLUT(size, np.array(table, dtype=np.float32))
+
+
+def write_cube(path: Path, lut: ImageFilter.Color3DLUT, title="Graphene"):
+    size = lut.size[0]
+    table = np.asarray(lut.table, dtype=np.float32).reshape(-1, 3)
+    with open(path, "w") as file:
+        file.write(f'TITLE "{title}"\n')
+        file.write(f"LUT_3D_SIZE {size}\n")
+        file.write("DOMAIN_MIN 0.0 0.0 0.0\n")
+        file.write("DOMAIN_MAX 1.0 1.0 1.0\n")
+        for r, g, b in table:
+            file.write(f"{r:.6f} {g:.6f} {b:.6f}\n")
+    logger.debug(f"Wrote {size}^3 LUT to {path}")
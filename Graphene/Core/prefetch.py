@@ -0,0 +1,101 @@
+"""
+Warms image_cache with the images around the one that is being looked at, so that stepping through a roll doesn't
+wait on the decoder. Closest images first, and cheap things (thumbnails, proxies) before full resolution ones.
+"""
+
+import logging
+import threading
+from concurrent.futures import Future
+from queue import Full
+from typing import Callable
+
+from .utils import get_pool
+
+logger = logging.getLogger("Core.Prefetch")
+
+# what gets warmed, in the order it gets warmed for any one distance
+STAGES = ("thumbnail", "proxy", "full")
+
+
+class Prefetcher:
+    """
+    Queues (index, stage) jobs on the "io" pool. Every call to schedule cancels whatever was queued for the old
+    position (jobs that already started are left to finish, they're still useful to the cache).
+
+    Args:
+        warm: warm(index, stage) does the actual work
+        count: How many images there are, indices wrap around like ImageManager.next/previous do
+        window: How many images on either side of the current one get a thumbnail and a proxy
+        full_window: How many images on either side get decoded at full resolution
+    """
+
+    def __init__(
+        self,
+        warm: Callable[[int, str], object],
+        count: int,
+        window=8,
+        full_window=1,
+    ):
+        self.warm = warm
+        self.count = count
+        self.window = window
+        self.full_window = full_window
+        self._futures: list[Future] = []
+        self._lock = threading.Lock()
+
+    @property
+    def queue_depth(self) -> int:
+        with self._lock:
+            return sum(1 for future in self._futures if not future.done())
+
+    def get_jobs(self, center: int):
+        """(priority, index, stage) for everything in the window around center, nearest and cheapest first"""
+        seen = set()
+        jobs = []
+        for distance in range(self.window + 1):
+            for index in (center + distance, center - distance):
+                index %= self.count
+                for rank, stage in enumerate(STAGES):
+                    if stage == "full" and distance > self.full_window:
+                        continue
+                    if (index, stage) in seen:
+                        continue
+                    seen.add((index, stage))
+                    # a full decode next door should wait for thumbnails a few images away
+                    priority = distance + rank * 2
+                    jobs.append((priority, index, stage))
+        return jobs
+
+    def schedule(self, center: int):
+        """Cancels whatever was queued and queues the window around center"""
+        if self.count == 0:
+            return
+        pool = get_pool("io")
+        with self._lock:
+            for future in self._futures:
+                future.cancel()
+            self._futures = []
+            # this runs on the GUI thread, so rather warm less than wait for the queue
+            for priority, index, stage in self.get_jobs(center):
+                try:
+                    self._futures.append(
+                        pool.submit(
+                            self._warm, index, stage, priority=priority, block=False
+                        )
+                    )
+                except Full:
+                    logger.debug("io queue is full, skipping the furthest images")
+                    break
+        logger.debug(f"Prefetching around {center}, {len(self._futures)} jobs queued")
+
+    def cancel(self):
+        with self._lock:
+            for future in self._futures:
+                future.cancel()
+            self._futures = []
+
+    def _warm(self, index, stage):
+        try:
+            self.warm(index, stage)
+        except Exception:
+            logger.exception(f"Could not prefetch {stage} of image {index}")
@@ -0,0 +1,79 @@
+"""
+Runs kernels over horizontal strips of an image on a thread pool. Pillow and NumPy let go of the GIL while they do the
+heavy lifting, so full resolution renders get to use more than one core.
+"""
+
+import logging
+import os
+
+import PIL.Image as PImage
+
+from .utils import get_pool
+
+logger = logging.getLogger("Core.Tiling")
+
+# strips smaller than this cost more in thread overhead than they save, so proxies just run on the calling thread
+MIN_STRIP_PIXELS = 1 << 20
+
+
+def get_strips(width, height, halo=0):
+    """
+    Splits the rows of an image into one strip per core (fewer if the image is small).
+
+    Returns:
+        list of (top, bottom, padded_top, padded_bottom), the padded rows include `halo` rows of neighbours on each side
+        that aren't at the edge of the image
+    """
+    count = min(os.cpu_count() or 1, width * height // MIN_STRIP_PIXELS, height)
+    count = max(count, 1)
+    bounds = [height * i // count for i in range(count + 1)]
+    return [
+        (top, bottom, max(top - halo, 0), min(bottom + halo, height))
+        for top, bottom in zip(bounds, bounds[1:])
+    ]
+
+
+def map_tiles(kernel, image: PImage.Image, halo=0, planes=()):
+    """
+    Returns kernel(image, *planes), worked out strip by strip on the "tile" pool.
+
+    Args:
+        kernel: PImage -> PImage (or a tuple of them) that gives back images the same size as its input, and doesn't
+            care where in the image it is
+        image: The input
+        halo: How many rows of neighbours an output row depends on, 0 for point operations and 1 for a 3x3 filter
+        planes: Arrays the same height as the image (like a luma plane that is already worked out), every strip gets
+            the matching rows of each of them
+
+    Returns:
+        Whatever kernel returns
+    """
+    width, height = image.size
+    strips = get_strips(width, height, halo)
+    if len(strips) == 1:
+        return kernel(image, *planes)
+
+    logger.debug(f"Running {kernel} over {len(strips)} strips of {image.size}")
+    futures = [
+        get_pool("tile").submit(
+            kernel,
+            image.crop((0, padded_top, width, padded_bottom)),
+            *(plane[padded_top:padded_bottom] for plane in planes),
+        )
+        for _, _, padded_top, padded_bottom in strips
+    ]
+    parts = [future.result() for future in futures]
+
+    single = isinstance(parts[0], PImage.Image)
+    if single:
+        parts = [(part,) for part in parts]
+
+    outs = []
+    for index, first in enumerate(parts[0]):
+        out = PImage.new(first.mode, image.size)
+        for (top, bottom, padded_top, _), part in zip(strips, parts):
+            part = part[index]
+            offset = top - padded_top
+            out.paste(part.crop((0, offset, width, offset + bottom - top)), (0, top))
+        outs.append(out)
+    return outs[0] if single else tuple(outs)
@@ -1,7 +1,12 @@
+import itertools
 import logging
+import math
+import os
 import threading
 import time
-from queue import Queue
+from concurrent.futures import FIRST_COMPLETED, Future, wait
+from queue import Empty, PriorityQueue
+from typing import Callable, Hashable
 
 logger = logging.getLogger("Core.Utils")
 
@@ -41,30 +46,248 @@ class Singleton(type):
         return cls._instances[cls]
 
 
-class ShittyMultiThreading:
-    """terrible, utterly horrendous. doesn't even store the return values lmao"""
+class WorkerPool:
+    """
+    A thread pool, but with priorities (lower runs first) and a bounded queue, so that whoever is submitting work
+    slows down instead of queueing up the whole roll. Gives back concurrent.futures.Future, which carry the return
+    value (or the exception) and can be cancelled while they are still queued.
+    """
+
+    def __init__(self, name: str, num_threads: int, max_queue=0) -> None:
+        self.name = name
+        self.num_threads = num_threads
+        self._queue = PriorityQueue(maxsize=max_queue)
+        self._sequence = itertools.count()
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+        # submits that are putting a job in the queue, shutdown waits for them so nothing lands behind the sentinels
+        self._closed = False
+        self._submitting = 0
+        self._submitted = threading.Condition(self._lock)
+
+    @property
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def submit(
+        self, fn: Callable, *args, priority=0, block=True, timeout=None, **kwargs
+    ) -> Future:
+        """
+        Queues fn(*args, **kwargs). If the queue is full this waits for space (raises queue.Full if block is False or
+        timeout runs out).
+        """
+        with self._lock:
+            if self._closed:
+                raise RuntimeError(f"{self.name} pool has been shut down")
+            self._submitting += 1
+        future = Future()
+        try:
+            self._queue.put(
+                (priority, next(self._sequence), future, fn, args, kwargs),
+                block,
+                timeout,
+            )
+            self._start()
+        finally:
+            with self._lock:
+                self._submitting -= 1
+                self._submitted.notify_all()
+        return future
+
+    def _start(self):
+        with self._lock:
+            while len(self._threads) < self.num_threads:
+                thread = threading.Thread(
+                    target=self._worker,
+                    name=f"{self.name}-{len(self._threads)}",
+                    daemon=True,
+                )
+                self._threads.append(thread)
+                thread.start()
+
+    def _worker(self):
+        while True:
+            _, _, future, fn, args, kwargs = self._queue.get()
+            try:
+                if future is None:
+                    return
+                if not future.set_running_or_notify_cancel():
+                    continue
+                try:
+                    result = fn(*args, **kwargs)
+                except BaseException as e:
+                    future.set_exception(e)
+                else:
+                    future.set_result(result)
+            finally:
+                self._queue.task_done()
+
+    def shutdown(self, wait=True, cancel_pending=True):
+        """Stops the workers once they are done with what they are running (and the queue, unless cancel_pending)"""
+        with self._lock:
+            self._closed = True
+            # a submit waiting for space gets it, the workers are still running
+            self._submitted.wait_for(lambda: not self._submitting)
+        if cancel_pending:
+            while True:
+                try:
+                    _, _, future, *_ = self._queue.get_nowait()
+                except Empty:
+                    break
+                future.cancel()
+                self._queue.task_done()
+        with self._lock:
+            threads = list(self._threads)
+        for _ in threads:
+            self._queue.put((math.inf, next(self._sequence), None, None, (), {}))
+        if wait:
+            for thread in threads:
+                thread.join()
+        logger.debug(f"Shut down {self.name} pool")
+
+
+# io is for reading files, cpu for whole jobs (evaluating a node, exporting an image) and tile for the strips map_tiles
+# splits those jobs into. eval runs whole graph evaluations (see LatestWins), which hand their nodes to cpu. Every
+# level waits on the one below it, so they can't share a pool: a job waiting on its own parts in a full pool never ends.
+POOL_SIZES = {
+    "io": 4,
+    "eval": 4,
+    "cpu": os.cpu_count() or 1,
+    "tile": os.cpu_count() or 1,
+}
+
+# How many jobs each pool queues before submit() waits (0 for no limit). eval only ever holds the one running evaluation
+# and the one pending, the rest are a few rounds of jobs per worker, enough to keep them busy.
+POOL_QUEUES = {
+    "io": 256,
+    "eval": 0,
+    "cpu": 4 * POOL_SIZES["cpu"],
+    "tile": 4 * POOL_SIZES["tile"],
+}
+
+_pools: dict[str, WorkerPool] = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(name: str) -> WorkerPool:
+    """The shared pool called `name` (see POOL_SIZES and POOL_QUEUES), made the first time it is asked for"""
+    with _pools_lock:
+        if name not in _pools:
+            _pools[name] = WorkerPool(
+                name.capitalize(), POOL_SIZES[name], max_queue=POOL_QUEUES[name]
+            )
+        return _pools[name]
+
+
+def shutdown_pools(wait=True):
+    """Call this when the app exits, before the dearpygui context is destroyed. Whatever is still queued is cancelled"""
+    with _pools_lock:
+        pools = list(_pools.values())
+        _pools.clear()
+    for pool in pools:
+        pool.shutdown(wait=wait, cancel_pending=True)
 
-    # TODO: every thread started by this godforsaken "threadpool" should be killed when dearpygui exits
 
-    def __init__(self, work, tasks, num_threads=5) -> None:
+def run_graph(
+    dependencies: dict[Hashable, set], run: Callable, pool="cpu", check=lambda: None
+):
+    """
+    Runs run(task) for every task in `dependencies` (task -> the tasks it waits for) on a pool, each one as soon as
+    everything it waits for is done, so independent branches run at the same time.
+
+    check() is called before every dispatch. If it raises (like LatestWins.check) nothing new is started, whatever is
+    already running is waited for and the exception is passed on. So is the first exception a task raises.
+    """
+    waiting = {
+        task: set(deps) & dependencies.keys() for task, deps in dependencies.items()
+    }
+    dependents = {task: [] for task in dependencies}
+    for task, deps in waiting.items():
+        for dep in deps:
+            dependents[dep].append(task)
+
+    pool = get_pool(pool)
+    running: dict[Future, Hashable] = {}
+    error = None
+    ready = [task for task, deps in waiting.items() if not deps]
+    while ready or running:
+        if error is None:
+            try:
+                for task in ready:
+                    check()
+                    running[pool.submit(run, task)] = task
+            except BaseException as e:
+                error = e
+            ready = []
+        if not running:
+            break
+        done, _ = wait(running, return_when=FIRST_COMPLETED)
+        for future in done:
+            task = running.pop(future)
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            for dependent in dependents[task]:
+                waiting[dependent].discard(task)
+                if not waiting[dependent]:
+                    ready.append(dependent)
+    if error is not None:
+        raise error
+
+
+class Cancelled(Exception):
+    """Raised by LatestWins.check when whatever is running has been superseded"""
+
+
+class LatestWins:
+    """
+    Runs work(request) on the "eval" pool, one request at a time. Requests that come in while one is running are
+    merged into a single pending one (by default the newest simply replaces the older), and the running one can call
+    check() between steps to give up early because it is stale.
+
+    Args:
+        work: Gets the request, is never run twice at once
+        merge: merge(pending, new) -> what should run next
+    """
+
+    def __init__(self, work: Callable, name="LatestWins", merge=lambda old, new: new):
         self.work = work
-        self.num_threads = num_threads
-        self.queue = Queue(maxsize=len(tasks))
-        for task in tasks:
-            self.queue.put(task)
-
-    def worker(self):
-        while not self.queue.empty():
-            task = self.queue.get()
-            self.work(task)
-            self.queue.task_done()
-
-    def start(self):
-        threads = []
-        for _ in range(self.num_threads):
-            threads.append(threading.Thread(target=self.worker))
-        for thread in threads:
-            thread.start()
+        self.name = name
+        self.merge = merge
+        self._pending = None
+        self._has_pending = False
+        self._running = False
+        self._lock = threading.Lock()
+
+    def submit(self, request=None):
+        with self._lock:
+            self._pending = (
+                self.merge(self._pending, request) if self._has_pending else request
+            )
+            self._has_pending = True
+            if self._running:
+                return
+            self._running = True
+        get_pool("eval").submit(self._drain)
+
+    def check(self):
+        """Call this from inside work, raises Cancelled if another request is waiting"""
+        if self._has_pending:
+            raise Cancelled
+
+    def _drain(self):
+        while True:
+            with self._lock:
+                if not self._has_pending:
+                    self._running = False
+                    return
+                request, self._pending, self._has_pending = self._pending, None, False
+            try:
+                self.work(request)
+            except Cancelled:
+                logger.debug(f"{self.name}: dropped a stale run of {request}")
+            except Exception:
+                logger.exception(f"{self.name}: {request} failed")
 
 
 class SimpleTimer:
@@ -1,8 +1,9 @@
 from .colour_balance import ColourBalance
 from .enhancement_nodes import Brightness, Contrast, Saturation, Sharpness
-from .graph_abc import Edge, Node, InspectNode
+from .graph_abc import Edge, Node, InspectNode, PointNode
 from .image_nodes import ImageNode
 from .inspect_nodes import HistogramNode, PreviewNode
 from .levels import Levels
+from .look import Look
 from .merge import Merge
 from .splitters import RGBSplitter, SMHSplitter
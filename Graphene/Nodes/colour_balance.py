@@ -4,7 +4,7 @@ from typing import Callable
 import dearpygui.dearpygui as dpg
 from line_profiler import profile
 
-from Graphene.Core import Image, colour_balance
+from Graphene.Core import Image, colour_balance, map_tiles
 
 from .graph_abc import Node
 
@@ -78,33 +78,45 @@ class ColourBalance(Node):
             return False
         return True
 
+    def get_balance(self):
+        """The slider values as colour_balance's (shadows, midtones, highlights, preserve_luminance) arguments"""
+        preserve = dpg.get_value(self.preserve_luminance)
+
+        dr_s = int(dpg.get_value(self.red_shadows) * 200 - 100)
+        dg_s = int(dpg.get_value(self.green_shadows) * 200 - 100)
+        db_s = int(dpg.get_value(self.blue_shadows) * 200 - 100)
+
+        dr_m = int(dpg.get_value(self.red_midtones) * 200 - 100)
+        dg_m = int(dpg.get_value(self.green_midtones) * 200 - 100)
+        db_m = int(dpg.get_value(self.blue_midtones) * 200 - 100)
+
+        dr_h = int(dpg.get_value(self.red_highlights) * 200 - 100)
+        dg_h = int(dpg.get_value(self.green_highlights) * 200 - 100)
+        db_h = int(dpg.get_value(self.blue_highlights) * 200 - 100)
+
+        return [dr_s, dg_s, db_s], [dr_m, dg_m, db_m], [dr_h, dg_h, db_h], preserve
+
+    def get_params(self, is_final=False):
+        shadows, midtones, highlights, preserve = self.get_balance()
+        return tuple(shadows), tuple(midtones), tuple(highlights), preserve
+
+    def colour_transform(self, image: Image):
+        balance = self.get_balance()
+        return lambda raw_image: colour_balance(raw_image, *balance)
+
     @profile
     def process(self, is_final=True):
         if self.input_attributes[self.image_attribute]:
             edge = self.input_attributes[self.image_attribute][0]
             image: Image = edge.data
-            preserve = dpg.get_value(self.preserve_luminance)
-
-            dr_s = int(dpg.get_value(self.red_shadows) * 200 - 100)
-            dg_s = int(dpg.get_value(self.green_shadows) * 200 - 100)
-            db_s = int(dpg.get_value(self.blue_shadows) * 200 - 100)
-
-            dr_m = int(dpg.get_value(self.red_midtones) * 200 - 100)
-            dg_m = int(dpg.get_value(self.green_midtones) * 200 - 100)
-            db_m = int(dpg.get_value(self.blue_midtones) * 200 - 100)
-
-            dr_h = int(dpg.get_value(self.red_highlights) * 200 - 100)
-            dg_h = int(dpg.get_value(self.green_highlights) * 200 - 100)
-            db_h = int(dpg.get_value(self.blue_highlights) * 200 - 100)
+            balance = self.get_balance()
 
-            updated_image = colour_balance(
+            updated_image = map_tiles(
+                lambda strip, luma: colour_balance(strip, *balance, luminance=luma),
                 image.raw_image,
-                [dr_s, dg_s, db_s],
-                [dr_m, dg_m, db_m],
-                [dr_h, dg_h, db_h],
-                preserve,
+                planes=(image.luma,),
             )
-            image = Image("NA", updated_image, (600, 600), (200, 200))
+            image = image.derive(updated_image)
 
             for edge in self.output_attributes[self.image_output_attribute]:
                 edge.data = image
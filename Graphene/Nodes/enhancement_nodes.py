@@ -5,9 +5,17 @@ import dearpygui.dearpygui as dpg
 from PIL import ImageEnhance
 from line_profiler import profile
 
-from Graphene.Core import Image
-
-from .graph_abc import Node
+from Graphene.Core import (
+    Image,
+    brightness_lut,
+    compose_luts,
+    contrast_lut,
+    get_mean,
+    get_mean_luma,
+    map_tiles,
+)
+
+from .graph_abc import Node, PointNode
 
 logger = logging.getLogger("GUI.EnhanceNodes")
 
@@ -45,16 +53,26 @@ class EnhanceNode(Node):
             return False
         return True
 
+    def get_params(self, is_final=False):
+        return dpg.get_value(self.slider)
+
+    def colour_transform(self, image: Image):
+        factor = dpg.get_value(self.slider)
+        return lambda raw_image: self.enhancement(raw_image).enhance(factor=factor)
+
     @profile
     def process(self, is_final=False):
         if self.input_attributes[self.image_attribute]:
             edge = self.input_attributes[self.image_attribute][0]
             image: Image = edge.data
-            enhancer = self.enhancement(image.raw_image)
             factor = dpg.get_value(self.slider)
-            updated_image = enhancer.enhance(factor=factor)
+            updated_image = map_tiles(
+                lambda strip: self.enhancement(strip).enhance(factor=factor),
+                image.raw_image,
+                halo=self.halo,
+            )
 
-            image = Image("NA", updated_image, (600, 600), (200, 200))
+            image = image.derive(updated_image)
 
             for edge in self.output_attributes[self.image_output_attribute]:
                 edge.data = image
@@ -73,7 +91,10 @@ class Saturation(EnhanceNode):
         super().__init__(label, parent, update_hook, enhancement, default_value)
 
 
-class Contrast(EnhanceNode):
+class Contrast(PointNode, EnhanceNode):
+    # blends towards the mean of the whole frame
+    roi_safe = False
+
     def __init__(
         self,
         parent: str | int,
@@ -84,8 +105,19 @@ class Contrast(EnhanceNode):
     ):
         super().__init__(label, parent, update_hook, enhancement, default_value)
 
+    def fold_lut(self, image: Image, lut):
+        if lut is None:
+            # ImageEnhance.Contrast takes the mean of convert("L"), which isn't quite luma
+            mean = get_mean(image.grey_histogram)
+        else:
+            mean = get_mean_luma(image.histogram, lut)
+        return compose_luts(lut, contrast_lut(dpg.get_value(self.slider), mean))
+
 
 class Sharpness(EnhanceNode):
+    # ImageEnhance.Sharpness blends with a 3x3 smoothing filter
+    halo = 1
+
     def __init__(
         self,
         parent: str | int,
@@ -96,8 +128,12 @@ class Sharpness(EnhanceNode):
     ):
         super().__init__(label, parent, update_hook, enhancement, default_value)
 
+    def colour_transform(self, image: Image):
+        # it looks at the neighbours
+        return None
 
-class Brightness(EnhanceNode):
+
+class Brightness(PointNode, EnhanceNode):
     def __init__(
         self,
         parent: str | int,
@@ -107,3 +143,6 @@ class Brightness(EnhanceNode):
         label="Brightness",
     ):
         super().__init__(label, parent, update_hook, enhancement, default_value)
+
+    def fold_lut(self, image: Image, lut):
+        return compose_luts(lut, brightness_lut(dpg.get_value(self.slider)))
@@ -1,17 +1,21 @@
 import logging
 import functools
+import itertools
 import time
 
 from abc import ABC, ABCMeta, abstractmethod
 from dataclasses import dataclass
-from typing import Any, Callable, Literal
+from typing import Any, Callable, Hashable
 
 import dearpygui.dearpygui as dpg
 
-from Graphene.Core import natural_time
+from Graphene.Core import Image, apply_lut, natural_time
 
 logger = logging.getLogger("GUI.GraphABC")
 
+# every edit and every output gets the next number, so comparing two of them says whether anything happened in between
+generations = itertools.count(1)
+
 
 @dataclass
 class Edge:
@@ -22,16 +26,17 @@ class Edge:
     input_attribute_id: str | int
     output_attribute_id: str | int
 
-    def connect(self):
+    def connect(self) -> bool:
         if self.output.validate_input(
             self, self.input_attribute_id
         ) and self.input.validate_output(self, self.output_attribute_id):
             self.input.add_output(self, self.input_attribute_id)
             self.output.add_input(self, self.output_attribute_id)
             logger.debug(f"Connected {self.input} to {self.output} via {self}")
-            return
+            return True
         logger.warning(f"Failed to connect {self.input} to {self.output} via {self}")
         dpg.delete_item(self.id)
+        return False
 
     def disconnect(self):
         # DO NOT CHANGE THE ORDER IN WHICH THESE FUNCTIONS ARE CALLED
@@ -72,6 +77,13 @@ class Node(ABC, metaclass=TimedMeta):
     Node do the processing, Edges store the data
     """
 
+    # pixels of neighbours an output pixel depends on, for running in strips and for padding regions of interest
+    halo = 0
+    # False if the output depends on the whole frame (like a mean), then nothing upstream of it gets cropped
+    roi_safe = True
+    # False if process() has to run every time (it shows something, or its outputs are cached somewhere else already)
+    cache_outputs = True
+
     def __init__(
         self,
         label: str,
@@ -101,7 +113,14 @@ class Node(ABC, metaclass=TimedMeta):
         self.output_attributes: dict[str | int, list[Edge]] = {}
         self.update_hook = update_hook
         self.delete_hook = delete_hook
-        self.state: Literal[0, 1] = 0
+        # bumped by activate
+        self.version = next(generations)
+        # bumped every time this node fills its output edges
+        self.output_version = 0
+        # get_signature() as of the last time this node ran, it has to run again if that has changed
+        self.seen = None
+        # what the outputs in the edges were worked out from, see get_params
+        self.output_key: str | None = None
 
     def delete(self):
         self.delete_hook()
@@ -149,11 +168,57 @@ class Node(ABC, metaclass=TimedMeta):
         self.update_hook()
 
     def activate(self):
-        self.state = 1
+        """Marks this node as changed, it and everything downstream of it run at the next evaluation"""
+        self.version = next(generations)
         logger.debug(str(self))
-        for attribute in self.output_attributes.values():
-            for edge in attribute:
-                edge.output.activate()
+
+    def get_signature(self) -> tuple:
+        """What this node's outputs come from, as versions: its own and those of the outputs of the nodes feeding it"""
+        return self.version, tuple(
+            edge.input.output_version
+            for edges in self.input_attributes.values()
+            for edge in edges
+        )
+
+    def is_dirty(self) -> bool:
+        """Whether this node's output edges are out of date, assuming everything upstream isn't"""
+        return self.seen != self.get_signature()
+
+    def claim(self):
+        """Call this before process(), an edit made while it runs then makes the node dirty again"""
+        self.seen = self.get_signature()
+        self.output_version = next(generations)
+
+    def unclaim(self):
+        """Call this if process() didn't finish after claim(), the node then runs again at the next evaluation"""
+        self.seen = None
+
+    def get_params(self, is_final=False) -> Hashable | None:
+        """
+        Everything besides the inputs that the outputs depend on. Together with the keys of the inputs this addresses
+        the outputs in the node cache, so dragging a slider back to where it was doesn't work them out again.
+
+        Returns None (the default) if they can't be cached, then nothing downstream can be either.
+        """
+        return None
+
+    def get_display(self):
+        """Whatever process() shows in the node itself (like a histogram), kept in the node cache with the outputs"""
+        return None
+
+    def show_display(self, display):
+        """Shows what get_display gave back, for when the outputs come out of the node cache instead of process()"""
+        pass
+
+    def colour_transform(self, image: Image) -> Callable | None:
+        """
+        If this node's output only depends on the colour of each input pixel, returns what it does as a PImage -> PImage
+        function, so that a chain of these can be baked into a 3D LUT. Anything that depends on image statistics (like
+        Contrast's mean) is measured on `image`, which is what the node would normally get as input.
+
+        Returns None for everything else (the default).
+        """
+        return None
 
     def validate_input(self, edge, attribute_id) -> bool:
         return True
@@ -162,9 +227,65 @@ class Node(ABC, metaclass=TimedMeta):
         return True
 
     def __str__(self):
-        return f"{self.label} {id(self)} state: {self.state}"
+        return f"{self.label} {id(self)} version: {self.version}"
 
 
 class InspectNode(Node):
+    cache_outputs = False
+
     def __init__(self, label: str, parent: str | int, update_hook: Callable):
         super().__init__(label, parent, update_hook)
+
+    def get_params(self, is_final=False):
+        return ()
+
+
+class PointNode(Node):
+    """
+    A node where every output pixel only depends on the same pixel (and channel) of the input, so the whole thing fits
+    in a 3x256 lookup table. The evaluator folds runs of these into one table and applies it once, instead of making a
+    new image at every node.
+
+    Subclasses need an `image_attribute` input and an `image_output_attribute` output.
+    """
+
+    @abstractmethod
+    def fold_lut(self, image: Image, lut):
+        """
+        Returns `lut` followed by this node's table. `lut` is what is still pending on `image` (None if nothing is).
+        This is also used to bake looks from other images, so it must not change what the node shows (see
+        update_display).
+        """
+        pass
+
+    def update_display(self, image: Image, lut):
+        """Shows whatever the node shows about its input, which is `image` after `lut`. Only called from process()"""
+        pass
+
+    def colour_transform(self, image: Image) -> Callable:
+        lut = self.fold_lut(image, None)
+        return lambda raw_image: apply_lut(raw_image, lut)
+
+    def process(self, is_final=False, chain: list["PointNode"] | None = None):
+        """
+        `chain` is a run of PointNodes ending in this one, where each node only feeds the next. The input of the first
+        goes through all of their tables in one pass and the result ends up in this node's output edges.
+        """
+        chain = chain or [self]
+        head = chain[0]
+        if not head.input_attributes[head.image_attribute]:
+            return
+        edge = head.input_attributes[head.image_attribute][0]
+        if not edge.data:
+            return
+
+        image: Image = edge.data
+        lut = None
+        for node in chain:
+            node.update_display(image, lut)
+            lut = node.fold_lut(image, lut)
+        image = image.apply_lut(lut)
+
+        for edge in self.output_attributes[self.image_output_attribute]:
+            edge.data = image
+            logger.debug(f"Populated edge {edge.id} with image from {self.id}")
@@ -3,7 +3,8 @@ from typing import Callable
 
 import dearpygui.dearpygui as dpg
 
-from Graphene.Core import Image
+from Graphene.Core import FULL_FRAME, Image
+from Graphene.utils import TexturePool
 
 from .graph_abc import Node
 
@@ -11,28 +12,62 @@ logger = logging.getLogger("GUI.ImageNodes")
 
 
 class ImageNode(Node):
+    # proxies are in image_cache already
+    cache_outputs = False
+
     def __init__(
-        self, label: str, parent: str | int, image: Image, update_hook: Callable
+        self,
+        label: str,
+        parent: str | int,
+        image: Image,
+        update_hook: Callable,
+        view_hint: Callable[["ImageNode"], tuple] = lambda node: (
+            (400, 300),
+            FULL_FRAME,
+            0,
+        ),
     ):
+        """
+        `view_hint` gives (size, region, padding) for this node. Size is how big (in screen pixels) the whole frame would
+        be in the most zoomed in widget the output is shown in, proxies are picked to be just big enough for it. Only
+        `region` of the frame (see Image.crop), plus `padding` pixels, is sent on.
+        """
         super().__init__(label, parent, update_hook=update_hook)
         self.image = image
-        with dpg.texture_registry():
-            dpg.add_dynamic_texture(
-                200,
-                200,
-                default_value=image.thumbnail,
-                tag=f"{self.id}_image",
-            )
-            logger.debug("Added entry to texture_registry")
+        self.view_hint = view_hint
+        self.texture_tag = TexturePool().acquire(
+            image.thumbnail_dimensions, image.thumbnail
+        )
         self.image_attribute = self.add_attribute(
             label="Image", attribute_type=dpg.mvNode_Attr_Output
         )
-        dpg.add_image(f"{self.id}_image", parent=self.image_attribute)
+        dpg.add_image(self.texture_tag, parent=self.image_attribute)
         logger.debug("Added image to node")
 
+    def delete(self):
+        super().delete()
+        TexturePool().release(self.texture_tag)
+
+    def get_params(self, is_final=False):
+        if self.image.cache_key is None:
+            return None
+        return self.image.cache_key, None if is_final else self.resolve_view()
+
+    def resolve_view(self):
+        """
+        What process() sends on when previewing, as (pyramid level, region, padding). Sizes that pick the same level
+        give the same image, so this only changes when the output really does.
+        """
+        size, region, padding = self.view_hint(self)
+        return self.image.get_proxy_level(size), region, padding
+
     def process(self, is_final=False):
+        if is_final:
+            image = self.image
+        else:
+            level, region, padding = self.resolve_view()
+            image = self.image.get_pyramid_level(level).crop(region, padding)
         # put the image in all connected output edges
         for edge in self.output_attributes[self.image_attribute]:
-            # TODO: adjust scaling so that the image isn't grainy
-            edge.data = self.image if is_final else self.image.get_scaled_image()
+            edge.data = image
             logger.debug(f"Populated edge {edge.id} with image from {self.id}")
@@ -6,7 +6,8 @@ from typing import Callable
 import dearpygui.dearpygui as dpg
 from line_profiler import profile
 
-from Graphene.Core import Image, get_histogram
+from Graphene.Core import FULL_FRAME, Image, Region
+from Graphene.utils import TexturePool
 
 from .graph_abc import Node, Edge, InspectNode
 
@@ -34,6 +35,9 @@ def set_up_line_plot_themes():
 
 
 class HistogramNode(InspectNode):
+    # shows the whole frame, not what the previews are zoomed in on
+    roi_safe = False
+
     def __init__(self, label: str, parent: str | int, update_hook: Callable):
         super().__init__(label, parent, update_hook=update_hook)
         self.image_attribute = self.add_attribute(
@@ -93,7 +97,7 @@ class HistogramNode(InspectNode):
         if not edge.data:
             return
         image: Image = edge.data
-        histogram = get_histogram(image.raw_image)
+        histogram = [image.histogram[i * 256 : (i + 1) * 256] for i in range(3)]
         dpg.set_value(f"{self.id}_R", [[i for i in range(256)], histogram[0]])
         dpg.set_value(f"{self.id}_G", [[i for i in range(256)], histogram[1]])
         dpg.set_value(f"{self.id}_B", [[i for i in range(256)], histogram[2]])
@@ -120,6 +124,14 @@ class PreviewNode(InspectNode):
     ):
         super().__init__(label, parent, update_hook)
         self.image: Image = get_default_image().get_scaled_image()
+        # float32 pixels of whatever is on screen, reused for every upload of the same size
+        self.texture = None
+        self.texture_size = None
+        self.texture_tag = None
+        # width / height of the frame, the plot's x axis goes from 0 to this and the y axis from 0 to 1
+        self.aspect = None
+        # what the evaluator last rendered for this preview, see get_view_region
+        self.rendered_region = FULL_FRAME
         self.image_attribute = self.add_attribute(
             label="Image", attribute_type=dpg.mvNode_Attr_Input
         )
@@ -134,6 +146,11 @@ class PreviewNode(InspectNode):
             with dpg.plot_axis(dpg.mvYAxis, no_tick_labels=True) as self.yaxis:
                 self.register_and_show_image(self.image, self.yaxis)
             logger.debug("Added default image to preview node")
+        # zooming and panning happen inside the plot, so only the mouse tells us about them
+        with dpg.handler_registry() as self.handlers:
+            dpg.add_mouse_wheel_handler(callback=self.view_changed)
+            dpg.add_mouse_release_handler(callback=self.view_changed)
+            dpg.add_mouse_move_handler(callback=self.view_changed)
 
     def validate_input(self, edge, attribute_id) -> bool:
         # only permitting a single connection
@@ -144,40 +161,114 @@ class PreviewNode(InspectNode):
             return False
         return True
 
-    def register_and_show_image(self, image: Image, parent: str | int):
-        # remember to delete any pre_existing image_series and textures
-        with dpg.texture_registry():
-            size = image.raw_image.size
-            dpg.add_dynamic_texture(
-                *size,
-                default_value=image.dpg_raw,
-                tag=f"{self.id}_image",
+    def get_display_size(self) -> tuple[int, int]:
+        """How many screen pixels the plot takes up"""
+        width, height = dpg.get_item_rect_size(self.plot)
+        if not width or not height:
+            # not drawn yet
+            width, height = dpg.get_item_width(self.plot), dpg.get_item_height(
+                self.plot
             )
-        logger.debug("Added entry to texture_registry")
+        return width, height
+
+    def get_view_region(self) -> Region:
+        """The part of the frame the plot is zoomed in on, the frame is drawn over [0, aspect] x [0, 1]"""
+        if self.aspect is None:
+            return FULL_FRAME
+        x_min, x_max = dpg.get_axis_limits(self.xaxis)
+        y_min, y_max = dpg.get_axis_limits(self.yaxis)
+        region = tuple(
+            min(max(value, 0.0), 1.0)
+            for value in (
+                x_min / self.aspect,
+                1 - y_max,
+                x_max / self.aspect,
+                1 - y_min,
+            )
+        )
+        if region[2] <= region[0] or region[3] <= region[1]:
+            # panned off the image
+            return FULL_FRAME
+        return region
+
+    def view_changed(self):
+        """Mouse handler, asks for an evaluation if zooming or panning has moved the plot off what was rendered"""
+        if not dpg.is_item_hovered(self.plot):
+            return
+        if self.get_view_region() != self.rendered_region:
+            self.update_hook()
+
+    def get_texture_size(self, image: Image) -> tuple[int, int]:
+        """How many screen pixels `image` covers at the current zoom"""
+        width, height = self.get_display_size()
+        view = self.get_view_region()
+        region = image.region
+        return (
+            max(int(width * (region[2] - region[0]) / (view[2] - view[0])), 1),
+            max(int(height * (region[3] - region[1]) / (view[3] - view[1])), 1),
+        )
+
+    def register_and_show_image(self, image: Image, parent: str | int):
+        size, self.texture = image.get_texture(self.get_display_size(), self.texture)
+        self.texture_size = size
+        self.texture_tag = TexturePool().acquire(size, self.texture)
         dpg.add_image_series(
-            f"{self.id}_image",
+            self.texture_tag,
             [0, 0],
-            image.raw_image.size,
+            [1, 1],
             parent=parent,
             tag=f"{self.id}_image_series",
         )
+        dpg.add_line_series([], [], parent=parent, tag=f"{self.id}_frame")
+        self.place(image)
+
+    def show_texture(self, size: tuple[int, int], texture, image: Image):
+        """Shows texture, swapping in a pooled texture of the new size if it has changed"""
+        if size == self.texture_size:
+            dpg.set_value(self.texture_tag, texture)
+        else:
+            # the old texture can be deleted once it's released, so stop showing it first
+            old_texture = self.texture_tag
+            self.texture_tag = TexturePool().acquire(size, texture)
+            self.texture_size = size
+            dpg.configure_item(f"{self.id}_image_series", texture_tag=self.texture_tag)
+            TexturePool().release(old_texture)
+        self.place(image)
+
+    def place(self, image: Image):
+        """Puts the image series where image.region is in the frame, refitting the plot only if the frame changed shape"""
+        left, top, right, bottom = image.region
+        width, height = image.size
+        aspect = (width / (right - left)) / (height / (bottom - top))
+        dpg.configure_item(
+            f"{self.id}_image_series",
+            bounds_min=(left * aspect, 1 - bottom),
+            bounds_max=(right * aspect, 1 - top),
+        )
+        if self.aspect is not None and abs(aspect - self.aspect) < 1e-3:
+            # same frame, leave the zoom alone
+            return
+        self.aspect = aspect
+        # the outline of the frame, so fitting the axes shows all of it even if only a crop is drawn
+        dpg.set_value(f"{self.id}_frame", [[0, aspect, aspect, 0, 0], [0, 0, 1, 1, 0]])
+        dpg.set_item_width(self.plot, int(aspect * 300))
         dpg.fit_axis_data(self.yaxis)
-        width, height = image.raw_image.width, image.raw_image.height
-        ratio = width / height
-        dpg.set_item_width(self.plot, int(ratio * 300))
         dpg.fit_axis_data(self.xaxis)
 
+    def delete(self):
+        dpg.delete_item(self.handlers)
+        super().delete()
+        TexturePool().release(self.texture_tag)
+
     @profile
     def process(self, is_final=False):
         if self.input_attributes[self.image_attribute]:
             edge = self.input_attributes[self.image_attribute][0]
             image: Image = edge.data
-            if self.image.raw_image.size != image.raw_image.size:
-                dpg.delete_item(f"{self.id}_image")
-                dpg.delete_item(f"{self.id}_image_series")
-                self.register_and_show_image(image, parent=self.yaxis)
-            else:
-                dpg.set_value(f"{self.id}_image", image.dpg_raw)
+            size, self.texture = image.get_texture(
+                self.get_texture_size(image), self.texture
+            )
+            self.show_texture(size, self.texture, image)
 
             self.image = image
             if is_final:
@@ -5,9 +5,14 @@ from typing import Callable
 import dearpygui.dearpygui as dpg
 from line_profiler import profile
 
-from Graphene.Core import Image, get_rgb_histogram, levels
+from Graphene.Core import (
+    Image,
+    compose_luts,
+    get_lut_histogram,
+    levels_lut,
+)
 
-from .graph_abc import Node
+from .graph_abc import PointNode
 
 logger = logging.getLogger("GUI.Levels")
 
@@ -22,7 +27,7 @@ def set_up_line_plot_themes():
     return luma_theme
 
 
-class Levels(Node):
+class Levels(PointNode):
     def __init__(
         self,
         label: str,
@@ -30,6 +35,8 @@ class Levels(Node):
         update_hook: Callable = lambda: None,
     ):
         super().__init__(label, parent, update_hook)
+        # L histogram of the input, as last shown
+        self.histogram = None
         self.image_attribute = self.add_attribute(
             label="Image", attribute_type=dpg.mvNode_Attr_Input
         )
@@ -96,24 +103,32 @@ class Levels(Node):
             return False
         return True
 
-    @profile
-    def process(self, is_final=False):
-        if self.input_attributes[self.image_attribute]:
-            edge = self.input_attributes[self.image_attribute][0]
-            if not edge.data:
-                return
+    def get_params(self, is_final=False):
+        return (
+            dpg.get_value(self.black_level),
+            dpg.get_value(self.white_level),
+            dpg.get_value(self.gamma),
+        )
 
-            black = dpg.get_value(self.black_level) / 255
-            white = dpg.get_value(self.white_level) / 255
-            gamma = dpg.get_value(self.gamma)
+    def get_display(self):
+        return self.histogram
 
-            image: Image = edge.data
-            histogram = get_rgb_histogram(image.raw_image)
+    def show_display(self, histogram):
+        if histogram is not None:
+            self.histogram = histogram
             dpg.set_value(f"{self.id}_luma", [[i for i in range(256)], histogram])
-            updated_image = levels(image.raw_image, black, white, gamma)
 
-            image = Image("NA", updated_image, (600, 600), (200, 200))
+    @profile
+    def update_display(self, image: Image, lut):
+        if lut is None:
+            histogram = image.grey_histogram
+        else:
+            histogram = get_lut_histogram(image.raw_image, lut)
+        self.show_display(histogram)
 
-            for edge in self.output_attributes[self.image_output_attribute]:
-                edge.data = image
-                logger.debug(f"Populated edge {edge.id} with image from {self.id}")
+    @profile
+    def fold_lut(self, image: Image, lut):
+        black = dpg.get_value(self.black_level) / 255
+        white = dpg.get_value(self.white_level) / 255
+        gamma = dpg.get_value(self.gamma)
+        return compose_luts(lut, levels_lut(black, white, gamma))
@@ -0,0 +1,82 @@
+import logging
+from pathlib import Path
+from typing import Callable
+
+import dearpygui.dearpygui as dpg
+
+from Graphene.Core import Image, apply_3d_lut, read_cube
+
+from .graph_abc import Node
+
+logger = logging.getLogger("GUI.Look")
+
+
+class Look(Node):
+    """
+    Applies a 3D LUT loaded from a .cube file, like the ones Graph > Export Looks writes
+    """
+
+    def __init__(
+        self,
+        label: str,
+        parent: str | int,
+        update_hook: Callable = lambda: None,
+    ):
+        super().__init__(label, parent, update_hook)
+        self.lut = None
+        # where self.lut was read from, and when that file was last changed
+        self.lut_key = None
+        self.image_attribute = self.add_attribute(
+            label="Image", attribute_type=dpg.mvNode_Attr_Input
+        )
+        self.image_output_attribute = self.add_attribute(
+            label="Out", attribute_type=dpg.mvNode_Attr_Output
+        )
+        with dpg.group(parent=self.image_attribute, width=200):
+            self.path = dpg.add_input_text(
+                hint="path/to/look.cube", on_enter=True, callback=self.load
+            )
+            dpg.add_button(label="Load", callback=self.load)
+
+    def load(self):
+        path = Path(dpg.get_value(self.path))
+        try:
+            lut_key = (str(path.resolve()), path.stat().st_mtime_ns)
+            lut = read_cube(path)
+        except (OSError, ValueError) as e:
+            logger.error(f"Could not load look from {path}: {e}")
+            return
+        self.lut, self.lut_key = lut, lut_key
+        logger.debug(f"Loaded look from {path}")
+        self.update()
+
+    def validate_input(self, edge, attribute_id) -> bool:
+        # only permitting a single connection
+        if self.input_attributes[self.image_attribute]:
+            logger.warning("Invalid! You can only connect one image node to look node")
+            return False
+        return True
+
+    def get_params(self, is_final=False):
+        # nothing loaded passes the image through
+        return self.lut_key or ()
+
+    def colour_transform(self, image: Image):
+        lut = self.lut
+        if lut is None:
+            return lambda raw_image: raw_image
+        return lambda raw_image: raw_image.filter(lut)
+
+    def process(self, is_final=False):
+        if not self.input_attributes[self.image_attribute]:
+            return
+        edge = self.input_attributes[self.image_attribute][0]
+        if not edge.data:
+            return
+        image: Image = edge.data
+        if self.lut is not None:
+            image = image.derive(apply_3d_lut(image.raw_image, self.lut))
+
+        for edge in self.output_attributes[self.image_output_attribute]:
+            edge.data = image
+            logger.debug(f"Populated edge {edge.id} with image from {self.id}")
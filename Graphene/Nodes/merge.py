@@ -3,7 +3,7 @@ from typing import Callable
 
 from dearpygui import dearpygui as dpg
 
-from Graphene.Core import Image, merge
+from Graphene.Core import MERGE_MODES, Image, merge
 from Graphene.Nodes import Node
 
 logger = logging.getLogger("GUI.Merge")
@@ -18,16 +18,25 @@ class Merge(Node):
         self.image_output_attribute = self.add_attribute(
             label="Out", attribute_type=dpg.mvNode_Attr_Output
         )
-        dpg.add_text(
-            "Merely adds channels together", wrap=100, parent=self.image_attribute
+        self.mode = dpg.add_combo(
+            MERGE_MODES,
+            default_value="Add",
+            width=100,
+            callback=self.update,
+            parent=self.image_attribute,
         )
 
+    def get_params(self, is_final=False):
+        return dpg.get_value(self.mode)
+
     def process(self, is_final=False):
         super().process(is_final)
-        images = (
-            edge.data.raw_image for edge in self.input_attributes[self.image_attribute]
-        )
-        out = Image("N/A", merge(images), (600, 600), (200, 200))
+        if not self.input_attributes[self.image_attribute]:
+            return
+        inputs = [edge.data for edge in self.input_attributes[self.image_attribute]]
+        # merge only pulls one layer out of this at a time
+        merged = merge((image.layer for image in inputs), mode=dpg.get_value(self.mode))
+        out = inputs[0].derive(merged, "N/A")
         for edge in self.output_attributes[self.image_output_attribute]:
             edge.data = out
             logger.debug(f"Populated edge {edge.id} with image from {self.id}")
@@ -4,7 +4,14 @@ from typing import Callable
 from dearpygui import dearpygui as dpg
 from PIL import Image as PImage
 
-from Graphene.Core import Image, split_rgb, split_smh
+from Graphene.Core import (
+    ChannelImage,
+    ChannelView,
+    Image,
+    map_tiles,
+    split_rgb,
+    split_smh,
+)
 from Graphene.Nodes import Node
 
 logger = logging.getLogger("GUI.Splitter")
@@ -28,6 +35,8 @@ class Splitter(Node):
 
         self.channel_histogram = {}
         self.channel_outs = {}
+        # channel -> the histogram last shown for it
+        self.histograms = {}
 
         with dpg.plot(height=200, width=200, parent=self.image_attribute):
             dpg.add_plot_axis(dpg.mvXAxis, label="Value", no_label=True)
@@ -66,22 +75,40 @@ class Splitter(Node):
         if not edge.data:
             return
         image: Image = edge.data
-        out: list[PImage.Image] = self.splitter_func(image.raw_image)
+        out = self.split(image)
 
         for i, channel_name in enumerate(self.channel_labels):
             # compute and update histogram
-            channel = out[i]
-            histogram = channel.convert("L").histogram()
-            dpg.set_value(
-                self.channel_histogram[channel_name], [list(range(256)), histogram]
-            )
+            channel = self.wrap(image, out[i])
+            self.show_display({channel_name: channel.grey_histogram})
 
             channel_attr = self.channel_outs[channel_name]
             for edge in self.output_attributes[channel_attr]:
-                edge.data = Image("N/A", channel, (600, 600), (200, 200))
+                edge.data = channel
 
         logger.debug(f"Processed histogram in histogram node {self.id}")
 
+    def get_params(self, is_final=False):
+        return ()
+
+    def get_display(self):
+        return dict(self.histograms)
+
+    def show_display(self, histograms):
+        for channel_name, histogram in histograms.items():
+            self.histograms[channel_name] = histogram
+            dpg.set_value(
+                self.channel_histogram[channel_name], [list(range(256)), histogram]
+            )
+
+    def split(self, image: Image):
+        """Runs splitter_func, in strips on big images"""
+        return map_tiles(self.splitter_func, image.raw_image)
+
+    def wrap(self, image: Image, channel: PImage.Image) -> Image:
+        """Turns whatever splitter_func gave back for `image` into the Image that goes into the output edges"""
+        return image.derive(channel, "N/A")
+
     def validate_input(self, edge, attribute_id) -> bool:
         # only permitting a single connection
         if self.input_attributes[self.image_attribute]:
@@ -103,6 +130,20 @@ class RGBSplitter(Splitter):
     ):
         super().__init__(label, parent, update_hook, splitter_func, channel_labels)
 
+    def split(self, image: Image):
+        # this just hands out views of the image's (shared) array, there's nothing to spread over threads
+        return self.splitter_func(image.array)
+
+    def wrap(self, image: Image, channel: ChannelView) -> Image:
+        # no zero padded copies, those only get made if a preview wants to show one
+        return ChannelImage(
+            "N/A",
+            channel,
+            image.main_image_dimensions,
+            image.thumbnail_dimensions,
+            region=image.region,
+        )
+
 
 class SMHSplitter(Splitter):
     def __init__(
@@ -114,3 +155,6 @@ class SMHSplitter(Splitter):
         channel_labels=["Shadows", "Midtones", "Highlights"],
     ):
         super().__init__(label, parent, update_hook, splitter_func, channel_labels)
+
+    def split(self, image: Image):
+        return map_tiles(self.splitter_func, image.raw_image, planes=(image.luma,))
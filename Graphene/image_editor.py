@@ -1,17 +1,48 @@
+import contextlib
+import hashlib
 import itertools
 import logging
-from collections import defaultdict, deque
+import threading
+import time
+from collections import deque
+from dataclasses import dataclass
 from pathlib import Path
 from line_profiler import profile
 
 import dearpygui.dearpygui as dpg
 
 import Graphene.Nodes as Nodes
-from Graphene.Core import ImageManager
+from Graphene.Core import (
+    FULL_FRAME,
+    LUT_SIZES,
+    Cancelled,
+    Graph,
+    Image,
+    ImageManager,
+    LatestWins,
+    apply_3d_lut,
+    bake,
+    node_cache,
+    run_graph,
+    write_cube,
+)
 from Graphene.Nodes.graph_abc import Edge
 
 logger = logging.getLogger("GUI.Editor")
 
+# fractions of the preview size an edit is rendered at, the first straight away and the rest one after the other while
+# nothing else is waiting
+REFINEMENT_STEPS = (0.25, 0.5, 1)
+REFINEMENT_DELAY = 0.15
+
+
+@dataclass(frozen=True)
+class EvaluationRequest:
+    is_final: bool = False
+    detail: float = 1
+    # a re-render of the last edit at a higher detail, rather than an edit
+    refinement: bool = False
+
 
 class EditingWindow:
     def __init__(self, source: list[Path]) -> None:
@@ -19,8 +50,26 @@ class EditingWindow:
             source, (600, 600), thumbnail_dimensions=(200, 200)
         )
         self.node_lookup_by_attribute_id = {}
-        self.edge_lookup_by_edge_id = {}
-        self.adjacency_list: dict[Nodes.Node, list[Nodes.Node]] = {}
+        # nodes, edges and the order they run in, kept up to date as links are made and removed
+        self.graph = Graph(is_sink=lambda node: isinstance(node, Nodes.InspectNode))
+        # evaluations run on a background thread, and only the newest parameters get rendered (see evaluate)
+        self.graph_lock = threading.RLock()
+        # cleared while the GUI waits for graph_lock to change the graph, a final render then stops at the next node
+        self.no_edit_waiting = threading.Event()
+        self.no_edit_waiting.set()
+        self.evaluator = LatestWins(
+            self.run_evaluation,
+            name="Evaluate",
+            merge=lambda old, new: old if old.is_final else new,
+        )
+        # fraction of the preview size that proxies are picked for, see REFINEMENT_STEPS
+        self.detail = 1
+        # what the edges were last filled for, "final" or "preview"
+        self.resolution = None
+        # what each ImageNode sends on, see update_views
+        self.views = {}
+        # what each ImageNode last resolved its view to (ImageNode.resolve_view)
+        self.resolved_views = {}
 
         with dpg.window(label="Image Editor", width=500, height=500):
             with dpg.menu_bar():
@@ -65,6 +114,10 @@ class EditingWindow:
                             "Make dark things darker or light things lighter or both."
                         )
 
+                    dpg.add_menu_item(label="Look (.cube)", callback=self.add_look_node)
+                    with dpg.tooltip(dpg.last_item()):
+                        dpg.add_text("Apply a 3D LUT from a .cube file.")
+
                 # with dpg.menu(label="Filters"):
                 #     dpg.add_menu_item(
                 #         label="Sharpness", callback=self.add_sharpness_node
@@ -118,30 +171,84 @@ class EditingWindow:
                             "Run the entire node graph and update all outputs."
                         )
 
+                    self.bake_toggle = dpg.add_menu_item(
+                        label="Bake Colour Graphs", check=True
+                    )
+                    with dpg.tooltip(dpg.last_item()):
+                        dpg.add_text(
+                            "When evaluating, previews that only have colour adjustments between them and their image are rendered through a single 3D LUT."
+                        )
+
+                    self.progressive_toggle = dpg.add_menu_item(
+                        label="Progressive Previews", check=True, default_value=True
+                    )
+                    with dpg.tooltip(dpg.last_item()):
+                        dpg.add_text(
+                            "Render edits at a quarter of the preview size first, then sharpen them while you're idle."
+                        )
+
+                    with dpg.menu(label="LUT Size"):
+                        self.lut_size = dpg.add_radio_button(
+                            [str(size) for size in LUT_SIZES],
+                            default_value=str(LUT_SIZES[0]),
+                        )
+
+                    dpg.add_menu_item(
+                        label="Export Looks (.cube)", callback=self.export_looks
+                    )
+                    with dpg.tooltip(dpg.last_item()):
+                        dpg.add_text(
+                            "Save the colour adjustments feeding each preview as a .cube file."
+                        )
+
             with dpg.node_editor(
                 callback=self.link, delink_callback=self.delink, minimap=True
             ) as self.node_editor:
                 pass
 
-    def link(self, sender, app_data):
-        id = dpg.add_node_link(app_data[0], app_data[1], parent=sender)
-        logger.debug(self.node_lookup_by_attribute_id)
+    @contextlib.contextmanager
+    def editing_graph(self):
+        """
+        Holds the graph still while it is changed. Queues an evaluation first, so that one that is running stops at the
+        next node instead of making the GUI wait for all of it (and the graph is evaluated again after the change).
+        A final render is started over once the change is made.
+        """
+        self.no_edit_waiting.clear()
+        try:
+            self.evaluate()
+            with self.graph_lock:
+                self.no_edit_waiting.set()
+                yield
+        finally:
+            self.no_edit_waiting.set()
 
-        input: Nodes.Node = self.node_lookup_by_attribute_id[app_data[0]]
-        output: Nodes.Node = self.node_lookup_by_attribute_id[app_data[1]]
+    def link(self, sender, app_data):
+        with self.editing_graph():
+            logger.debug(self.node_lookup_by_attribute_id)
+            input: Nodes.Node = self.node_lookup_by_attribute_id[app_data[0]]
+            output: Nodes.Node = self.node_lookup_by_attribute_id[app_data[1]]
+            if self.graph.reaches(output, input):
+                logger.warning(
+                    f"Invalid! Linking {input.label} to {output.label} makes a cycle"
+                )
+                return
 
-        edge = Nodes.Edge(id, None, input, output, app_data[0], app_data[1])
-        self.edge_lookup_by_edge_id[id] = edge
-        self.adjacency_list[input].append(output)
-        edge.connect()
+            id = dpg.add_node_link(app_data[0], app_data[1], parent=sender)
+            edge = Nodes.Edge(id, None, input, output, app_data[0], app_data[1])
+            if edge.connect():
+                self.graph.add_edge(edge)
 
     def delink(self, sender, app_data):
-        edge: Edge = self.edge_lookup_by_edge_id[app_data]
-        edge.disconnect()
-        self.adjacency_list[edge.input].remove(edge.output)
-        self.edge_lookup_by_edge_id.pop(edge.id)
+        with self.editing_graph():
+            edge: Edge = self.graph.edges[app_data]
+            edge.disconnect()
+            self.graph.remove_edge(edge.id)
 
     def delete_node(self, node):
+        with self.editing_graph():
+            self._delete_node(node)
+
+    def _delete_node(self, node):
         incoming = [e for edges in node.input_attributes.values() for e in edges]
         outgoing = [e for edges in node.output_attributes.values() for e in edges]
 
@@ -154,10 +261,8 @@ class EditingWindow:
 
         # Delink all connected edges
         for edge in incoming + outgoing:
-            edge_id = edge.id
-            if edge_id in self.edge_lookup_by_edge_id:
-                self.delink(self.node_editor, edge_id)
-                self.edge_lookup_by_edge_id.pop(edge_id, None)
+            if edge.id in self.graph.edges:
+                self.delink(self.node_editor, edge.id)
 
         # Reconnect A -> C if valid
         if reconnect:
@@ -168,19 +273,19 @@ class EditingWindow:
                     (next(iter(a.output_attributes)), next(iter(c.input_attributes))),
                 )
 
-        self.adjacency_list.pop(node, None)
-        for adj in self.adjacency_list.values():
-            if node in adj:
-                adj.remove(node)
+        self.graph.remove_node(node)
 
         for attr_id in itertools.chain(node.input_attributes, node.output_attributes):
             self.node_lookup_by_attribute_id.pop(attr_id, None)
 
     def add_node(self, node: Nodes.Node):
-        for attribute in itertools.chain(node.input_attributes, node.output_attributes):
-            self.node_lookup_by_attribute_id[attribute] = node
-        node.delete_hook = lambda: self.delete_node(node)
-        self.adjacency_list[node] = []
+        with self.editing_graph():
+            for attribute in itertools.chain(
+                node.input_attributes, node.output_attributes
+            ):
+                self.node_lookup_by_attribute_id[attribute] = node
+            node.delete_hook = lambda: self.delete_node(node)
+            self.graph.add_node(node)
 
     def add_rgb_splitter_node(self):
         node = Nodes.RGBSplitter(
@@ -218,6 +323,7 @@ class EditingWindow:
             parent=self.node_editor,
             image=self.image_manager.load(0),
             update_hook=self.evaluate,
+            view_hint=self.get_view,
         )
         self.add_node(node)
 
@@ -251,78 +357,436 @@ class EditingWindow:
         )
         self.add_node(node)
 
-    def get_visible_nodes(self):
+    def add_look_node(self):
+        node = Nodes.Look(
+            label="Look", parent=self.node_editor, update_hook=self.evaluate
+        )
+        self.add_node(node)
+
+    def get_colour_chain(self, preview: Nodes.PreviewNode):
+        """
+        Walks up from a preview to its ImageNode. If every node on the way has one input and only feeds the next one,
+        returns (image_node, nodes in order), otherwise None.
         """
-        Get a list of nodes that are not eventually connected to an InspectNode
+        chain = []
+        node = preview
+        while True:
+            edges = node.input_attributes.get(getattr(node, "image_attribute", None))
+            if not edges:
+                return None
+            parent = edges[0].input
+            if isinstance(parent, Nodes.ImageNode):
+                return parent, chain[::-1]
+            if len(parent.input_attributes) != 1 or self.graph.out_degree(parent) != 1:
+                return None
+            chain.append(parent)
+            node = parent
+
+    def bake_colour_chain(self, preview: Nodes.PreviewNode):
         """
-        inspect_nodes = [
-            node for node in self.adjacency_list if isinstance(node, Nodes.InspectNode)
+        Bakes the nodes between a preview and its image into a 3D LUT, if they only change colours. Statistics (like
+        Contrast's mean) are measured on the proxy.
+
+        Returns:
+            (image_node, nodes, lut) or None
+        """
+        found = self.get_colour_chain(preview)
+        if not found or not found[1]:
+            return None
+        image_node, chain = found
+        image: Image = image_node.image.get_scaled_image()
+        transforms = []
+        for node in chain:
+            transform = node.colour_transform(image)
+            if transform is None:
+                return None
+            transforms.append(transform)
+            image = image.derive(transform(image.raw_image))
+        lut = bake(transforms, int(dpg.get_value(self.lut_size)))
+        logger.debug(f"Baked {chain} into a LUT for {preview}")
+        return image_node, chain, lut
+
+    def export_looks(self):
+        for node in self.graph:
+            if not isinstance(node, Nodes.PreviewNode):
+                continue
+            baked = self.bake_colour_chain(node)
+            if baked is None:
+                logger.warning(f"{node} isn't fed by colour adjustments only, skipped")
+                continue
+            path = Path(f"./Data/{node.id}.cube")
+            write_cube(path, baked[2], title=f"Graphene {node.label} {node.id}")
+            logger.info(f"Exported look to {path}")
+
+    def get_preview_size(self):
+        """The size of the biggest PreviewNode plot, which is the most resolution a proxy needs"""
+        sizes = [
+            node.get_display_size()
+            for node in self.graph
+            if isinstance(node, Nodes.PreviewNode)
         ]
-        visible_nodes = set(inspect_nodes)
-        q = deque(inspect_nodes)
-        while q:
-            node = q.popleft()
-            for edge_list in node.input_attributes.values():
-                for edge in list(edge_list):  # copy to avoid mutation problems
-                    parent = edge.input
-                    if parent not in visible_nodes:
-                        visible_nodes.add(parent)
-                        q.append(parent)
-        return visible_nodes
+        if not sizes:
+            return 400, 300
+        return max(size[0] for size in sizes), max(size[1] for size in sizes)
+
+    def get_visible_nodes(self):
+        """
+        The nodes that are eventually connected to an InspectNode, see Graph.visible. Don't change it
+        """
+        return self.graph.visible
 
     def topological_sort(self):
         """
         Get a list of nodes to process in the correct order.
         (A will not be before B if the output of B is required for A)
+
+        Only the nodes that have to run are in it: the ones that are dirty themselves (see Node.is_dirty) and everything
+        downstream of those. The graph keeps its order up to date as it is edited, so this is a single pass over it.
+
+        Runs of PointNodes only fill the edges leaving their last node (see get_point_chains), so if one node of a run
+        is dirty, the run has to start again from its first node.
         """
-        # just kahn's algo: https://en.wikipedia.org/wiki/Topological_sorting
-        in_degree = defaultdict(int)
-        for node in self.adjacency_list:
-            for neighbour in self.adjacency_list[node]:
-                in_degree[neighbour] += 1
-
-        queue = [node for node in self.adjacency_list if in_degree[node] == 0]
-        dropped = [node for node in self.adjacency_list if node.state == 0]
-        sorted_list = []
-
-        while queue:
-            node = queue.pop()
-            if node.state == 1:
-                sorted_list.append(node)
-            logger.debug(f"{node}, adjecency - {self.adjacency_list[node]}")
-            for neighbour in self.adjacency_list[node]:
-                in_degree[neighbour] -= 1
-                if in_degree[neighbour] == 0:
-                    queue.append(neighbour)
-
-        logger.debug(f"Dropped nodes: {dropped}")
+        dirty = set()
+        for node in self.graph.order:
+            if node.is_dirty() or not dirty.isdisjoint(self.graph.predecessors[node]):
+                dirty.add(node)
+        for node in list(dirty):
+            parent = self.get_chain_parent(node)
+            while parent is not None and parent not in dirty:
+                dirty.add(parent)
+                parent = self.get_chain_parent(parent)
+        sorted_list = [node for node in self.graph.order if node in dirty]
         logger.debug(f"Execution order: {sorted_list}")
+        return sorted_list
+
+    def get_chain_parent(self, node: Nodes.Node) -> Nodes.PointNode | None:
+        """The PointNode that node would be fused after (see get_point_chains), if there is one"""
+        if not isinstance(node, Nodes.PointNode):
+            return None
+        edges = node.input_attributes[node.image_attribute]
+        parent = edges[0].input if edges else None
+        if isinstance(parent, Nodes.PointNode) and self.graph.out_degree(parent) == 1:
+            return parent
+        return None
+
+    def get_point_chains(self, sorted_node_list, visible_nodes):
+        """
+        Groups runs of PointNodes where each node only feeds the next one, so that the whole run can be applied as a
+        single lookup table. Every node maps to the run it is in (most runs are just the node by itself).
+        """
+        chains = {}
+        for node in sorted_node_list:
+            if node not in visible_nodes:
+                continue
+            chain = [node]
+            parent = self.get_chain_parent(node)
+            if parent in chains:
+                chain = chains[parent]
+                chain.append(node)
+            chains[node] = chain
+        return chains
+
+    def evaluate(self, is_final=False):
+        """
+        Every node's update_hook. Queues an evaluation on the background thread, requests that come in while one is
+        running are merged (a final one stays final, otherwise the newest wins) and a running preview evaluation gives
+        up at the next node.
+        """
+        detail = REFINEMENT_STEPS[0] if dpg.get_value(self.progressive_toggle) else 1
+        self.evaluator.submit(EvaluationRequest(is_final=is_final, detail=detail))
 
-        if len(sorted_list) + len(dropped) != len(self.adjacency_list):
-            logger.error("There is a cycle in your graph!!!")
-            return []
-        else:
-            return sorted_list
+    def get_proxy_size(self):
+        """What ImageNodes pick their proxies for, the preview size scaled down while an edit is being refined"""
+        width, height = self.get_preview_size()
+        return max(int(width * self.detail), 1), max(int(height * self.detail), 1)
+
+    def get_view(self, image_node: Nodes.ImageNode):
+        """ImageNode's view_hint, see update_views"""
+        return self.views.get(image_node, (self.get_proxy_size(), FULL_FRAME, 0))
+
+    def update_views(self, visible_nodes):
+        """
+        Works out what every ImageNode sends on, as (proxy size, region, padding). The region is the union of what the
+        previews downstream of it are zoomed in on, padded by the halos of the nodes on the way, and the proxy is picked
+        so that the most zoomed in preview gets a pixel per screen pixel (so 100% zoom renders at full resolution).
+        ImageNodes that end up in the same nodes (like both sides of a Merge) get the same view, so they line up.
+        ImageNodes are only activated if that changes the proxy or crop they send on, not for every new size.
+
+        Histograms shown in nodes (Levels, splitters) are of what gets rendered, so of the region when zoomed in.
+        """
+        groups: list[tuple[list, set]] = []
+        image_nodes = [n for n in visible_nodes if isinstance(n, Nodes.ImageNode)]
+        for node in image_nodes:
+            downstream = set()
+            queue = deque([node])
+            while queue:
+                for neighbour in self.graph.successors[queue.popleft()]:
+                    if neighbour in visible_nodes and neighbour not in downstream:
+                        downstream.add(neighbour)
+                        queue.append(neighbour)
+            members = [node]
+            for group in [g for g in groups if not downstream.isdisjoint(g[1])]:
+                groups.remove(group)
+                members += group[0]
+                downstream |= group[1]
+            groups.append((members, downstream))
+
+        views = {}
+        for group, downstream in groups:
+            previews = [n for n in downstream if isinstance(n, Nodes.PreviewNode)]
+            if not previews:
+                continue
+
+            cropped = all(n.roi_safe for n in downstream)
+            sizes, regions = [], []
+            for preview in previews:
+                width, height = preview.get_display_size()
+                region = preview.get_view_region()
+                preview.rendered_region = region
+                if cropped:
+                    width /= region[2] - region[0]
+                    height /= region[3] - region[1]
+                    regions.append(region)
+                sizes.append((width * self.detail, height * self.detail))
+            size = (
+                max(int(max(w for w, _ in sizes)), 1),
+                max(int(max(h for _, h in sizes)), 1),
+            )
+            region = FULL_FRAME
+            if cropped:
+                region = (
+                    min(r[0] for r in regions),
+                    min(r[1] for r in regions),
+                    max(r[2] for r in regions),
+                    max(r[3] for r in regions),
+                )
+            padding = sum(n.halo for n in downstream) if region != FULL_FRAME else 0
+            for node in group:
+                views[node] = (size, region, padding)
+        self.views = views
+
+        resolved_views = {node: node.resolve_view() for node in image_nodes}
+        for node, view in resolved_views.items():
+            if view != self.resolved_views.get(node):
+                logger.debug(f"{node} now sends level {view[0]} of {view[1]}")
+                node.activate()
+        self.resolved_views = resolved_views
+
+    @staticmethod
+    def get_output_key(chain: list[Nodes.Node], is_final) -> str | None:
+        """
+        What the outputs of a run of nodes (see get_point_chains) are worked out from, as a digest of the type and
+        parameters of every node in it and the keys of whatever feeds the first one. So two nodes only get the same key
+        if they'd give the same outputs, and a key only changes if something upstream really did.
+
+        None if any of that can't be cached.
+        """
+        params = []
+        for node in chain:
+            node_params = node.get_params(is_final)
+            if node_params is None:
+                return None
+            params.append((type(node).__name__, node_params))
+        inputs = []
+        for edges in chain[0].input_attributes.values():
+            for edge in edges:
+                if edge.input.output_key is None:
+                    return None
+                inputs.append(edge.input.output_key)
+        return hashlib.sha1(repr((params, inputs, is_final)).encode()).hexdigest()
+
+    @staticmethod
+    def store_outputs(chain: list[Nodes.Node], key: str | None):
+        """Puts what the last node in chain left in its output edges (one per attribute) into the node cache"""
+        node = chain[-1]
+        if key is None or not node.cache_outputs:
+            return
+        outputs = tuple(
+            edges[0].data if edges else None
+            for edges in node.output_attributes.values()
+        )
+        displays = [processed.get_display() for processed in chain]
+        nbytes = sum(image.nbytes for image in outputs if image is not None)
+        node_cache.put(key, (outputs, displays), "node", nbytes)
+
+    @staticmethod
+    def restore_outputs(chain: list[Nodes.Node], key: str | None) -> bool:
+        """Fills the output edges of the last node in chain from the node cache, False if they aren't all there"""
+        node = chain[-1]
+        if key is None or not node.cache_outputs:
+            return False
+        cached = node_cache.get(key, "node")
+        if cached is None:
+            return False
+        outputs, displays = cached
+        attributes = list(node.output_attributes.values())
+        if any(edges and image is None for edges, image in zip(attributes, outputs)):
+            # an output that wasn't connected back then
+            return False
+        for edges, image in zip(attributes, outputs):
+            for edge in edges:
+                edge.data = image
+        for processed, display in zip(chain, displays):
+            processed.show_display(display)
+        dpg.set_value(node.processing_time, "cached")
+        return True
+
+    @staticmethod
+    def release_edges(chain: list[Nodes.Node], will_run: dict):
+        """
+        Empties the edges a run of nodes read from, and the ones it filled that nothing in this evaluation reads. An
+        output goes to every edge leaving a node and each edge has one consumer, so the output is let go as soon as
+        its last consumer has run. Full resolution images then only live while something still needs them, instead of
+        every edge holding on to one until the next evaluation.
+        """
+        for edges in chain[0].input_attributes.values():
+            for edge in edges:
+                edge.data = None
+        for edges in chain[-1].output_attributes.values():
+            for edge in edges:
+                if edge.output not in will_run:
+                    edge.data = None
 
     # TODO: this bit can be cleaned up
     @profile
-    def evaluate(self, is_final=False):
-        if is_final:
+    def run_evaluation(self, request: EvaluationRequest):
+        if request.refinement:
+            # only refine once the user has stopped for a moment
+            time.sleep(REFINEMENT_DELAY)
+            self.evaluator.check()
+        # don't take the lock from under a graph edit that stopped this (or an earlier) run
+        self.no_edit_waiting.wait()
+        with self.graph_lock:
+            # everything has to be rendered again going to or from a final render, or Merge gets inputs of different
+            # sizes. Between previews (like the steps of a refinement) update_views activates the ImageNodes that change
+            resolution = "final" if request.is_final else "preview"
+            changed = resolution != self.resolution
+            self.detail = request.detail
+            if changed:
+                # if this gets cancelled halfway the edges are a mix of both
+                self.resolution = None
+            try:
+                self._run_evaluation(request.is_final, changed)
+            except Cancelled:
+                if request.is_final:
+                    # stopped for a graph edit, a final render has to happen anyway
+                    self.evaluator.submit(request)
+                raise
+            # final runs empty the edges as they go (see release_edges), so everything has to run again after one
+            self.resolution = None if request.is_final else resolution
+
+        if request.is_final or request.detail >= REFINEMENT_STEPS[-1]:
+            return
+        detail = next(step for step in REFINEMENT_STEPS if step > request.detail)
+        logger.debug(f"Refining previews at {detail} of their size")
+        self.evaluator.submit(EvaluationRequest(detail=detail, refinement=True))
+
+    def _run_evaluation(self, is_final, resolution_changed=False):
+        if is_final or resolution_changed:
             # activate all image nodes
             logger.debug(f"Activated all ImageNodes, is_final: {is_final}")
-            for node in self.adjacency_list.keys():
+            for node in self.graph:
                 if isinstance(node, Nodes.ImageNode):
                     node.activate()
 
         visible_nodes = self.get_visible_nodes()
+        if not is_final:
+            self.update_views(visible_nodes)
         sorted_node_list = self.topological_sort()
 
+        # previews that get their image straight from a baked LUT, and the nodes that don't need to run because of it
+        baked_luts = {}
+        if is_final and dpg.get_value(self.bake_toggle):
+            for node in sorted_node_list:
+                if isinstance(node, Nodes.PreviewNode) and node in visible_nodes:
+                    baked = self.bake_colour_chain(node)
+                    if baked is not None:
+                        baked_luts[node] = baked
+            baked_nodes = {n for _, chain, _ in baked_luts.values() for n in chain}
+            sorted_node_list = [n for n in sorted_node_list if n not in baked_nodes]
+
         logger.debug(
             f"Sorted node list: {sorted_node_list}, Visible Nodes: {visible_nodes}"
         )
-        for node in sorted_node_list:
-            if node in visible_nodes:
-                logger.debug(f"Processed Node {node}")
-                node.process(is_final=is_final)
-                node.state = 0
-                logger.debug(f"{node} state changed to 0")
+        chains = self.get_point_chains(sorted_node_list, visible_nodes)
+        # the last node in each run does the work for all of them, so runs are scheduled as a whole, keyed by that node
+        units = {
+            node: chains[node]
+            for node in sorted_node_list
+            if node in visible_nodes and chains[node][-1] is node
+        }
+        tail_of = {n: node for node, chain in units.items() for n in chain}
+        dependencies = {
+            node: {
+                tail_of[edge.input]
+                for edges in chain[0].input_attributes.values()
+                for edge in edges
+                if edge.input in tail_of
+            }
+            for node, chain in units.items()
+        }
+        for node, (image_node, _, _) in baked_luts.items():
+            # the baked nodes are claimed when the preview runs, which has to be after what feeds them
+            if node in units and image_node in tail_of:
+                dependencies[node].add(tail_of[image_node])
+
+        # previews can share baked nodes, those are claimed by whichever runs first
+        claimed_baked = set()
+        baked_lock = threading.Lock()
+
+        def run(node):
+            chain = units[node]
+            if node in baked_luts:
+                # before the preview, whose signature has their output versions in it
+                with baked_lock:
+                    for baked in baked_luts[node][1]:
+                        if baked in claimed_baked:
+                            continue
+                        claimed_baked.add(baked)
+                        baked.claim()
+                        # their edges are left as they were
+                        baked.output_key = None
+            # claimed before processing, so that an edit made while a node runs makes it dirty again
+            for processed in chain:
+                processed.claim()
+            try:
+                if node in baked_luts:
+                    image_node, _, lut = baked_luts[node]
+                    edge = node.input_attributes[node.image_attribute][0]
+                    edge.data = image_node.image.derive(
+                        apply_3d_lut(image_node.image.raw_image, lut)
+                    )
+                    logger.debug(f"Fed {node} through a baked LUT")
+                # only the last node of a run fills its edges, the others have no outputs anyone could look up
+                for processed in chain:
+                    processed.output_key = None
+                key = self.get_output_key(chain, is_final)
+                if self.restore_outputs(chain, key):
+                    logger.debug(f"Took the outputs of {node} from the node cache")
+                elif len(chain) > 1:
+                    logger.debug(f"Processed Nodes {chain} as one lookup table")
+                    node.process(is_final=is_final, chain=chain)
+                    self.store_outputs(chain, key)
+                else:
+                    logger.debug(f"Processed Node {node}")
+                    node.process(is_final=is_final)
+                    self.store_outputs(chain, key)
+                node.output_key = key
+            except BaseException:
+                # whatever it left in its edges is no good, and it has to run again
+                for processed in chain:
+                    processed.unclaim()
+                raise
+            if is_final:
+                self.release_edges(chain, tail_of)
+
+        def check():
+            if not is_final:
+                # a newer edit is waiting, rendering the rest of this one is wasted work
+                self.evaluator.check()
+            elif not self.no_edit_waiting.is_set():
+                # the GUI is blocked until this lets go of the graph, run_evaluation queues it again
+                raise Cancelled
+
+        # branches that don't depend on each other (like the outputs of a splitter) run at the same time
+        run_graph(dependencies, run, check=check)
@@ -1,6 +1,7 @@
 import logging
 import math
 import threading
+from collections import OrderedDict
 
 import dearpygui.dearpygui as dpg
 
@@ -41,6 +42,76 @@ def modal_message(message, checkbox=True):
     dpg.configure_item(warning, pos=newPos)
 
 
+class TexturePool(metaclass=Singleton):
+    """
+    Dynamic textures, shared by every node that shows an image and kept around by size. Creating and deleting textures
+    every time the size of a preview changes (proxy -> final render -> proxy) makes dearpygui reallocate them on the
+    GPU, handing back a free one of the same size only needs the pixels to be updated.
+
+    Only MAX_FREE_PER_SIZE free textures are kept of a size and MAX_FREE in total, the sizes used least recently are
+    deleted first.
+    """
+
+    MAX_FREE_PER_SIZE = 2
+    MAX_FREE = 16
+
+    def __init__(self):
+        self.registry = None
+        # most recently released size last
+        self.free: OrderedDict[tuple[int, int], list[int | str]] = OrderedDict()
+        self.sizes: dict[int | str, tuple[int, int]] = {}
+        # previews are processed in parallel
+        self.lock = threading.Lock()
+
+    def acquire(self, size: tuple[int, int], data) -> int | str:
+        """A texture of `size` (width, height) filled with data (see Core.to_texture)"""
+        size = tuple(size)
+        # the lock is always taken before dpg.mutex(), never the other way round
+        with self.lock:
+            if self.free.get(size):
+                texture = self.free[size].pop()
+                if not self.free[size]:
+                    del self.free[size]
+                dpg.set_value(texture, data)
+                return texture
+            # previews are rendered off the main thread, which is drawing at the same time
+            with dpg.mutex():
+                if self.registry is None:
+                    self.registry = dpg.add_texture_registry()
+                texture = dpg.add_dynamic_texture(
+                    *size, default_value=data, parent=self.registry
+                )
+            self.sizes[texture] = size
+            logger.debug(
+                f"Added {size} texture to the pool, {len(self.sizes)} in total"
+            )
+            return texture
+
+    def release(self, texture: int | str):
+        """Hands a texture back, nothing may show it after this"""
+        with self.lock:
+            size = self.sizes[texture]
+            free = self.free.setdefault(size, [])
+            free.append(texture)
+            self.free.move_to_end(size)
+            evicted = []
+            if len(free) > self.MAX_FREE_PER_SIZE:
+                evicted.append(free.pop(0))
+            while sum(len(textures) for textures in self.free.values()) > self.MAX_FREE:
+                oldest, textures = next(iter(self.free.items()))
+                evicted.append(textures.pop(0))
+                if not textures:
+                    del self.free[oldest]
+            if evicted:
+                with dpg.mutex():
+                    for old in evicted:
+                        dpg.delete_item(old)
+                        del self.sizes[old]
+                logger.debug(
+                    f"Deleted {len(evicted)} textures, {len(self.sizes)} left in the pool"
+                )
+
+
 class Logger(logging.Handler, metaclass=Singleton):
     """Snazzy"""
 
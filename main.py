@@ -5,6 +5,7 @@ import dearpygui.dearpygui as dpg
 from dearpygui import demo
 from themes import create_gruvbox_dark_theme
 
+import Graphene.Core
 import Graphene.image_editor
 import Graphene.utils
 
@@ -32,6 +33,18 @@ def main():
                 dpg.add_menu_item(
                     label="Show Performance Metrics", callback=dpg.show_metrics
                 )
+                dpg.add_menu_item(
+                    label="Log Image Cache Stats",
+                    callback=lambda: logger.info(Graphene.Core.image_cache.report()),
+                )
+                dpg.add_menu_item(
+                    label="Log Node Cache Stats",
+                    callback=lambda: logger.info(Graphene.Core.node_cache.report()),
+                )
+                dpg.add_menu_item(
+                    label="Log Scratch Buffer Stats",
+                    callback=lambda: logger.info(Graphene.Core.scratch.report()),
+                )
             with dpg.menu(label="Dev"):
                 dpg.add_menu_item(label="Show GUI Demo", callback=demo.show_demo)
                 dpg.add_menu_item(
@@ -70,6 +83,8 @@ def main():
     dpg.set_viewport_vsync(False)
     dpg.show_viewport(maximized=True)
     dpg.start_dearpygui()
+    # workers may still be showing results, so stop them while there is a context to show them in
+    Graphene.Core.shutdown_pools()
     dpg.destroy_context()
 
 